@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+import charts
+
+# Cross-country rollups over the store's yearly table. Everything works on a "cube": one row per
+# country code, one column per year, amounts in million dollars, built once per dataset version.
+
+
+def yearly_cube(yearly_df):
+    # In float64, totals and growth rates are computed from the amounts the store keeps in float32
+    yearly_df = yearly_df.assign(**{"Export Amount": charts.widen(yearly_df["Export Amount"])})
+    cube = yearly_df.pivot_table(
+        index="Country Code", columns="Year", values="Export Amount", aggfunc="sum", observed=True
+    )
+    return cube.set_axis(cube.index.astype(object), axis=0).set_axis(cube.columns.astype("int64"), axis=1)
+
+
+def yearly_totals(cube):
+    # Sum over all countries of each year
+    return cube.sum(axis=0).rename("Export Amount")
+
+
+def country_shares(cube):
+    # Percentage of each year's exports going to each country
+    return cube.div(cube.sum(axis=0), axis=1) * 100
+
+
+def yoy_growth(cube):
+    # Percentage change from the previous year, NaN where the previous year is zero or missing
+    previous = cube.shift(1, axis=1)
+    return (cube - previous).div(previous.where(previous > 0)) * 100
+
+
+def cagr(cube, start_year, end_year):
+    # Compound annual growth rate in percent between two years
+    start, end = cube[start_year], cube[end_year]
+    years = end_year - start_year
+    return ((end / start.where(start > 0)) ** (1 / years) - 1) * 100
+
+
+def compare_years(cube, start_year, end_year):
+    # Per-country change between two years, the table top_movers ranks
+    end_shares = country_shares(cube)[end_year]
+    return pd.DataFrame(
+        {
+            "Start Amount": cube[start_year],
+            "End Amount": cube[end_year],
+            "Change": cube[end_year] - cube[start_year],
+            "CAGR": cagr(cube, start_year, end_year),
+            "End Share": end_shares,
+        }
+    )
+
+
+def top_movers(cube, start_year, end_year, n=10, by="Change"):
+    # Biggest gainers and losers between two years
+    comparison = compare_years(cube, start_year, end_year).replace([np.inf, -np.inf], np.nan).dropna(subset=[by])
+    gainers = comparison[comparison[by] > 0].nlargest(n, by)
+    losers = comparison[comparison[by] < 0].nsmallest(n, by)
+    return gainers, losers
@@ -0,0 +1,276 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import tornado.ioloop
+import tornado.netutil
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+import aggregates
+import charts
+import history
+import search
+import utils
+
+# Read-only HTTP/JSON API over the same normalized store app.py reads, for dashboards that need the data without
+# driving the Streamlit script. It runs on tornado, which streamlit already depends on. Responses are cached
+# per URL and carry an ETag made from the dataset and history versions, so both expire when either changes. Past
+# builds of the store can be queried and compared through the history kept next to it.
+
+base_path = Path(__file__).parent
+
+
+class QueryStore:
+    # Store tables plus the registry, cube and product index app.py builds from them, and the response cache of
+    # that dataset version. Built off the IOLoop and never changed afterwards, a refresh builds a new one.
+    def __init__(self, dataset_path, store_path, version, max_cached=4096):
+        self.tables = utils.load_store(dataset_path, store_path)
+        self.registry = utils.CountryRegistry(self.tables["countries"])
+        self.cube = aggregates.yearly_cube(self.tables["yearly"])
+        self.products = search.ProductIndex(self.tables["products"])
+        self.history = history.History(history.default_history_path(store_path))
+        self.version = version
+        self.version_tag = hashlib.sha1(json.dumps(version, sort_keys=True).encode()).hexdigest()[:16]
+        self.max_cached = max_cached
+        self.cache = {}
+
+    def cache_body(self, key, body):
+        # Keep a response body for this dataset version, oldest entries evicted first. Only called on the IOLoop.
+        if len(self.cache) >= self.max_cached:
+            del self.cache[next(iter(self.cache))]
+        self.cache[key] = body
+
+
+class QueryService:
+    # The current QueryStore, replaced as a whole when the dataset changes. Reloading the store and answering
+    # queries that miss the cache (history diffs replay deltas) run in thread pools so the IOLoop keeps serving.
+    def __init__(self, dataset_path, store_path, workers=4):
+        self.dataset_path, self.store_path = Path(dataset_path), Path(store_path)
+        self.query_executor = ThreadPoolExecutor(max_workers=workers)
+        self.refresh_executor = ThreadPoolExecutor(max_workers=1)
+        self.store = QueryStore(self.dataset_path, self.store_path, self.current_version())
+
+    def current_version(self):
+        # The history can get a new version while the dataset stays the same (e.g. build_dataset.py recording it)
+        latest = history.History(history.default_history_path(self.store_path)).latest()
+        return {**utils.dataset_signature(self.dataset_path), "history": latest}
+
+    def reload(self):
+        # A new QueryStore if the dataset changed since the current one was loaded, None otherwise. Blocking.
+        version = self.current_version()
+        if version == self.store.version:
+            return None
+        return QueryStore(self.dataset_path, self.store_path, version)
+
+    async def refresh(self):
+        # Build the new store off the IOLoop, then swap it in at once: requests see either the old or the new one
+        store = await tornado.ioloop.IOLoop.current().run_in_executor(self.refresh_executor, self.reload)
+        if store is not None:
+            self.store = store
+        return store is not None
+
+
+def records(df):
+    # Rows as JSON objects, NaN as null, float32 amounts with their shortest decimals (see charts.widen)
+    return json.loads(df.apply(charts.widen).to_json(orient="records", force_ascii=False))
+
+
+def int_argument(params, name, default, minimum=None):
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise tornado.web.HTTPError(400, reason=f"{name} must be an integer")
+    if minimum is not None and value < minimum:
+        raise tornado.web.HTTPError(400, reason=f"{name} must be at least {minimum}")
+    return value
+
+
+def country_code(store, code):
+    code = code.upper()
+    if code not in store.registry.countries:
+        raise tornado.web.HTTPError(404, reason=f"Unknown country {code}")
+    return code
+
+
+def get_version(store, params):
+    return {"version": store.version, "tag": store.version_tag}
+
+
+def get_countries(store, params):
+    return records(store.tables["countries"].sort_values("Export Amount", ascending=False))
+
+
+def get_country_table(store, params, code, table_name):
+    return country_records(store.tables[table_name], params, country_code(store, code), table_name)
+
+
+def country_records(table_df, params, code, table_name):
+    country_df = utils.country_table(table_df, code)
+    if table_name == "monthly":
+        country_df = country_df.drop(columns=["Date"])
+    elif table_name == "items" and "top" in params:
+        country_df = country_df[: int_argument(params, "top", 10, minimum=0)]
+    return records(country_df)
+
+
+def get_totals(store, params):
+    return records(aggregates.yearly_totals(store.cube).reset_index())
+
+
+def year_argument(store, params, name, default):
+    year = int_argument(params, name, default)
+    if year not in store.cube.columns:
+        raise tornado.web.HTTPError(400, reason=f"No data for {name}={year}")
+    return year
+
+
+def get_shares(store, params):
+    year = year_argument(store, params, "year", store.cube.columns[-1])
+    shares = aggregates.country_shares(store.cube)[year].rename("Share").dropna().sort_values(ascending=False)
+    return records(shares.reset_index())
+
+
+def get_movers(store, params):
+    start_year = year_argument(store, params, "start", store.cube.columns[0])
+    end_year = year_argument(store, params, "end", store.cube.columns[-1])
+    by = params.get("by", "Change")
+    if by not in ("Change", "CAGR") or start_year >= end_year:
+        raise tornado.web.HTTPError(400, reason="by must be Change or CAGR and start must be before end")
+    n = int_argument(params, "n", 10, minimum=0)
+    gainers, losers = aggregates.top_movers(store.cube, start_year, end_year, n, by)
+    return {"gainers": records(gainers.reset_index()), "losers": records(losers.reset_index())}
+
+
+def get_products(store, params):
+    products = store.products.find(params.get("q", ""), int_argument(params, "limit", 20, minimum=0))
+    return [
+        {"Product": product, "Item": store.products.names[product], "Amount": store.products.totals[product]}
+        for product in products
+    ]
+
+
+def get_destinations(store, params):
+    product = params.get("product", "")
+    if product not in store.products:
+        raise tornado.web.HTTPError(404, reason=f"Unknown product {product}")
+    return records(store.products.destinations(product, int_argument(params, "n", 10, minimum=0)))
+
+
+def history_version(store, version):
+    if version not in {entry["version"] for entry in store.history.versions()}:
+        raise tornado.web.HTTPError(404, reason=f"Unknown version {version}")
+    return version
+
+
+def get_versions(store, params):
+    return [{**entry, "label": history.version_label(entry)} for entry in store.history.versions()]
+
+
+def get_version_country_table(store, params, version, code, table_name):
+    table_df = store.history.load(history_version(store, int(version)), [table_name])[table_name]
+    code = code.upper()
+    if code not in set(table_df["Country Code"]):
+        raise tornado.web.HTTPError(404, reason=f"No {table_name} rows for {code} in version {version}")
+    return country_records(table_df, params, code, table_name)
+
+
+def get_diff(store, params):
+    latest = store.history.latest()
+    if latest is None:
+        raise tornado.web.HTTPError(404, reason="No history recorded yet")
+    old_version = history_version(store, int_argument(params, "from", max(latest - 1, 1)))
+    new_version = history_version(store, int_argument(params, "to", latest))
+    tables = params["table"].split(",") if "table" in params else list(history.history_tables)
+    unknown = [name for name in tables if name not in history.history_tables]
+    if unknown:
+        raise tornado.web.HTTPError(400, reason=f"Unknown tables {unknown}")
+    country_codes = [code.upper() for code in params["country"].split(",")] if "country" in params else None
+    diffs = store.history.diff(old_version, new_version, tables, country_codes)
+    return {"from": old_version, "to": new_version, **{name: records(df) for name, df in diffs.items()}}
+
+
+class QueryHandler(tornado.web.RequestHandler):
+    def initialize(self, service, query):
+        self.service, self.query = service, query
+
+    async def get(self, *path_args):
+        # Same URL and same dataset version give the same body, so a matching If-None-Match needs no work at all.
+        # The whole request uses the store current when it arrived, even if a refresh swaps in a new one meanwhile.
+        store = self.service.store
+        key = self.request.uri
+        self.set_header("Etag", f'"{store.version_tag}-{hashlib.sha1(key.encode()).hexdigest()[:16]}"')
+        self.set_header("Cache-Control", "no-cache")
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+        body = store.cache.get(key)
+        if body is None:
+            params = {name: self.get_argument(name) for name in self.request.arguments}
+            body = await tornado.ioloop.IOLoop.current().run_in_executor(
+                self.service.query_executor,
+                lambda: json.dumps(self.query(store, params, *path_args), ensure_ascii=False).encode(),
+            )
+            store.cache_body(key, body)
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.write(body)
+
+    def write_error(self, status_code, **kwargs):
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.finish(json.dumps({"error": self._reason}, ensure_ascii=False))
+
+
+def make_app(service):
+    routes = [
+        (r"/api/version", get_version),
+        (r"/api/countries", get_countries),
+        (r"/api/countries/(\w+)/(yearly|monthly|items)", get_country_table),
+        (r"/api/aggregates/totals", get_totals),
+        (r"/api/aggregates/shares", get_shares),
+        (r"/api/aggregates/movers", get_movers),
+        (r"/api/products", get_products),
+        (r"/api/products/destinations", get_destinations),
+        (r"/api/versions", get_versions),
+        (r"/api/versions/diff", get_diff),
+        (r"/api/versions/(\d+)/countries/(\w+)/(yearly|monthly|items)", get_version_country_table),
+    ]
+    return tornado.web.Application(
+        [(pattern, QueryHandler, {"service": service, "query": query}) for pattern, query in routes]
+    )
+
+
+def serve(
+    port=8600, dataset_path=base_path / "dataset", store_path=base_path / "dataset_store", refresh=5.0, background=False
+):
+    # Serves until interrupted, or from a daemon thread when background is set (returns the bound port)
+    service = QueryService(dataset_path, store_path)
+    sockets = tornado.netutil.bind_sockets(port, "127.0.0.1")
+    bound_port = sockets[0].getsockname()[1]
+
+    def run():
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        HTTPServer(make_app(service)).add_sockets(sockets)
+        # The next check is scheduled once the previous refresh finished, refreshes never overlap
+        tornado.ioloop.PeriodicCallback(service.refresh, refresh * 1000).start()
+        tornado.ioloop.IOLoop.current().start()
+
+    if background:
+        threading.Thread(target=run, daemon=True).start()
+        return bound_port
+    print(f"Serving the dataset API on http://127.0.0.1:{bound_port}/api/countries")
+    run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the dataset as a JSON API")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--dataset", type=Path, default=base_path / "dataset")
+    parser.add_argument("--store", type=Path, default=base_path / "dataset_store")
+    parser.add_argument("--refresh", type=float, default=5.0, help="Seconds between dataset change checks")
+    args = parser.parse_args()
+
+    serve(args.port, args.dataset, args.store, args.refresh)
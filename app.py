@@ -3,7 +3,12 @@ from pathlib import Path
 import pandas as pd
 import streamlit as st
 import utils
-import numpy as np
+import aggregates
+import history
+import search
+import charts
+import tables
+import profiling
 import time
 
 st.set_page_config(
@@ -14,17 +19,168 @@ st.set_page_config(
     menu_items=None,
 )
 
+# Opt-in timing of this rerun, for every session with EXPORTS_PROFILE=1 or for this one with ?profile=1 in the URL
+profile_session = "profile" in st.experimental_get_query_params()
+profiling.start_rerun(force=profile_session)
+
 # Read data
 dataset_path = Path(__file__).parent / "dataset"
-df_metadata = pd.read_json(dataset_path / "metadata.json", orient="records")
-df_metadata = utils.normalize_money(df_metadata, "Export Amount", "Export Value")
+store_path = Path(__file__).parent / "dataset_store"
+# The latest dataset and one past version picked from the history stay resident
+versions_cached = 2
+
+
+@st.cache_resource(show_spinner=False)
+def load_history():
+    # Past builds of the store, shared by all sessions with the versions they materialized
+    return history.History(history.default_history_path(store_path))
+
+
+@st.cache_resource(max_entries=versions_cached * len(utils.store_tables), show_spinner=False)
+def load_table(table_name, dataset_version):
+    # Store tables are read the first time a chapter needs them, then shared by all sessions (read only),
+    # dataset_version invalidates them. A version picked from the history is rebuilt from its deltas instead.
+    with profiling.phase(f"load {table_name}"):
+        if "history" in dataset_version:
+            return load_history().load(dataset_version["history"], [table_name])[table_name]
+        return utils.load_store(dataset_path, store_path, [table_name])[table_name]
+
+
+@st.cache_resource(max_entries=versions_cached, show_spinner=False)
+def load_registry(dataset_version):
+    with profiling.phase("build registry"):
+        return utils.CountryRegistry(load_table("countries", dataset_version))
+
+
+@st.cache_resource(max_entries=versions_cached, show_spinner=False)
+def load_cube(dataset_version):
+    # Countries x years table every cross-country rollup is computed from
+    with profiling.phase("build cube"):
+        return aggregates.yearly_cube(load_table("yearly", dataset_version))
+
+
+@st.cache_resource(max_entries=versions_cached, show_spinner=False)
+def load_product_index(dataset_version):
+    with profiling.phase("build product index"):
+        return search.ProductIndex(load_table("products", dataset_version))
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def load_chart_frame(table_name, country_codes, fields, aggregate, max_points, dataset_version):
+    # Rows of the given countries from a store table, ready to draw: months summed into years when aggregating,
+    # long series downsampled, then only the encoded fields, downcast
+    with profiling.phase("prepare chart frame"):
+        table_df = load_table(table_name, dataset_version)
+        chart_df = table_df[table_df["Country Code"].isin(country_codes)]
+        if aggregate:
+            chart_df = chart_df.groupby(["Country Code", "Year"], as_index=False, sort=False, observed=True)[
+                "Export Amount"
+            ].sum()
+        chart_df = charts.downsample(chart_df, "Country Code", "Export Amount", max_points)
+        registry = load_registry(dataset_version)
+        chart_df = chart_df.assign(
+            **{"Country Name": chart_df["Country Code"].map(lambda code: registry.by_code(code).name)}
+        )
+        return charts.chart_frame(chart_df, fields)
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def load_legend_tables(top_k, num_columns, dataset_version):
+    # Code/name legend of the top countries, rendered once per top_k and split into columns
+    with profiling.phase("render legend"):
+        legend = load_table("countries", dataset_version).sort_values(by="Export Amount", ascending=False)[:top_k]
+        legend = legend[["Country Code", "Country Name"]].rename(
+            columns={"Country Code": "كود البلد", "Country Name": "أسم الدولة"}
+        )
+        return [tables.render_table(split) for split in tables.pages(legend, max(-(-len(legend) // num_columns), 1))]
+
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def load_items_tables(country_code, top_n, page_size, dataset_version):
+    # Pages of a country's items table rendered once per (country, top_n), the biggest countries have ~500 items
+    with profiling.phase("render items tables"):
+        items_df = utils.country_table(load_table("items", dataset_version), country_code)[["Item", "Amount"]]
+        items_df = items_df[:top_n] if isinstance(top_n, int) else items_df
+        items_df = items_df.rename(columns={"Item": "المنتجات", "Amount": "الصادرات بالمليون دولار"})
+        return [tables.render_table(page, decimals=3, na_rep="غير معلوم") for page in tables.pages(items_df, page_size)]
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def load_revisions(old_version, new_version, history_version):
+    # Rows that changed between two versions per table, with a count of each kind of change. Versions never change
+    # once recorded, history_version (the latest one) only tells a rewritten history apart.
+    with profiling.phase("diff versions"):
+        diffs = load_history().diff(old_version, new_version)
+        counts = pd.DataFrame(
+            {name: df["Change"].value_counts() for name, df in diffs.items()}, index=["added", "removed", "changed"]
+        )
+        return counts.fillna(0).astype(int).T, diffs
+
+
+def add_country(selection_key, query_key):
+    # Add the country closest to the typed query to a multiselect, then clear the query
+    matches = load_registry(dataset_version).find(st.session_state[query_key], limit=1)
+    if len(matches) > 0 and matches[0] not in st.session_state[selection_key]:
+        st.session_state[selection_key] = st.session_state[selection_key] + matches
+    st.session_state[query_key] = ""
+
+
+def country_multiselect(label, key, default):
+    names = load_registry(dataset_version).names
+    if key not in st.session_state:
+        st.session_state[key] = [default]
+    # The selection outlives a switch between dataset versions, countries missing from this one are dropped from it
+    available = set(names)
+    st.session_state[key] = [name for name in st.session_state[key] if name in available]
+    st.text_input(
+        "Find a Country",
+        key=f"{key}_query",
+        on_change=add_country,
+        args=(key, f"{key}_query"),
+        help="Type a country name with any spelling (or its code) and press Enter to add it",
+    )
+    return st.multiselect(label, names, key=key)
+
+
+def chapter(name, title, draw):
+    # Only open chapters are computed and sent to the browser. Streamlit doesn't tell the script whether an
+    # expander is expanded, so a chapter is opened with a checkbox and drawn below it while it's checked.
+    if st.checkbox(title, key=name.replace(" ", "_")):
+        with profiling.phase(name):
+            draw()
+
+
+# Add sidebar to streamlit and use it to customize the experience
+st.sidebar.markdown(
+    "<h1><b class='sidebar'>Customi</b>ze <b class='sidebar'>you</b>r <b class='sidebar'>Experien</b>ce</h1>",
+    unsafe_allow_html=True,
+)
+
+# Only what the sidebar needs is loaded before the first paint, chapters load the rest when opened
+with profiling.phase("load"):
+    latest_version = utils.dataset_signature(dataset_path)
+    dataset_version = latest_version
+    versions = {entry["version"]: entry for entry in load_history().versions()}
+    # The latest recorded version is the store being served unless the dataset changed since it was recorded
+    past_versions = sorted(versions, reverse=True)
+    if past_versions and versions[past_versions[0]]["dataset_version"] == utils.store_version(dataset_path):
+        past_versions = past_versions[1:]
+    if len(past_versions) > 0:
+        # Every build is kept in the history, an older one can be explored as it was
+        picked_version = st.sidebar.selectbox(
+            "Dataset Version",
+            [None] + past_versions,
+            format_func=lambda version: "Latest" if version is None else history.version_label(versions[version]),
+            help="Explore the data as it was after an earlier crawl",
+            key="dataset_version",
+        )
+        if picked_version is not None:
+            dataset_version = {"history": picked_version}
+    df_metadata = load_table("countries", dataset_version)
+    years = sorted(load_table("yearly", dataset_version)["Year"].unique().tolist())
 if "start_time" not in st.session_state:
     st.session_state["start_time"] = time.time()
 
-# Zip dataset folder
-zip_path = Path(__file__).parent / "exports_dataset.zip"
-utils.zip_directory(dataset_path, zip_path)
-
 # Global style for the app
 global_style = """
 			<style>
@@ -60,11 +216,6 @@ beautiful_shape = (
     "<br> . <br> ……… <br> ……………… <br> ……………………… <br> …………………………… <br> ……………………… <br> ……………… <br> ……… <br> ."
 )
 
-# Add sidebar to streamlit and use it to customize the experience
-st.sidebar.markdown(
-    "<h1><b class='sidebar'>Customi</b>ze <b class='sidebar'>you</b>r <b class='sidebar'>Experien</b>ce</h1>",
-    unsafe_allow_html=True,
-)
 st.sidebar.markdown(
     "<h3> ⭐ <b class='sidebar'>Chapt</b>er 1 <b class='sidebar'>Configurati</b>ons</h3>", unsafe_allow_html=True
 )
@@ -85,6 +236,18 @@ else:
     )
 diagram_option = st.sidebar.selectbox("Select Type of Diagram to show", ["Bar Chart", "Line Chart"], index=1)
 chapter2_num_columns = st.sidebar.slider("Number of side-by-side graphs", min_value=1, max_value=4, value=2)
+combine_countries = st.sidebar.checkbox(
+    "Combine Countries in One Chart",
+    value=False,
+    help="Draw one chart with a series per country, lighter and faster when comparing many countries",
+)
+max_points = st.sidebar.select_slider(
+    "Points per Monthly Series",
+    options=[24, 48, 96, "All"],
+    value="All",
+    help="Keep only the lowest and highest months of each stretch of a long monthly series",
+    disabled=yearly_or_monthly == "Yearly" or enable_aggregate,
+)
 st.sidebar.markdown("""---""")
 st.sidebar.markdown(
     "<h3> ⭐ <b class='sidebar'>Chapt</b>er 3 <b class='sidebar'>Configurati</b>ons</h3>", unsafe_allow_html=True
@@ -92,6 +255,20 @@ st.sidebar.markdown(
 # chapter3_num_columns = st.sidebar.select_slider("Number of side-by-side dataframes", options=[1,2,3], value=1)
 chapter3_num_columns = 1
 top_n_items = st.sidebar.select_slider("Show only top N items", options=list(range(1, 21)) + ["All"], value=10)
+items_page_size = st.sidebar.select_slider("Items per Page", options=[10, 25, 50, 100], value=25)
+top_n_destinations = st.sidebar.slider("Top Destinations of a Product", min_value=1, max_value=20, value=10)
+st.sidebar.markdown("""---""")
+st.sidebar.markdown(
+    "<h3> ⭐ <b class='sidebar'>Chapt</b>er 4 <b class='sidebar'>Configurati</b>ons</h3>", unsafe_allow_html=True
+)
+# The latest year is usually still being collected, so compare up to the one before it by default
+start_year, end_year = st.sidebar.select_slider(
+    "Years to Compare", options=years, value=(years[0], years[-2] if len(years) > 1 else years[-1])
+)
+top_n_movers = st.sidebar.slider("Top Movers to Show", min_value=1, max_value=20, value=10)
+movers_by = st.sidebar.radio(
+    "Rank Movers by", ["Change", "CAGR"], index=0, help="Change in million dollars or compound annual growth rate"
+)
 
 # Make a hidden present pop after 5 minutes
 if time.time() - st.session_state["start_time"] > 60 * 5:
@@ -111,16 +288,18 @@ st.markdown(
     "<h1 style='text-align:center;'>This will be a fun story about Egypt's exports 🤭</h1> <br>", unsafe_allow_html=True
 )
 
+
 # Chapter 1: The Story of the largest countries we export to
-with st.expander("Chapter 1: The Story of the largest countries we export to", expanded=False):
+def draw_chapter_1():
     st.markdown(
         "<h3 style='direction: rtl; text-align:center;'>أكثر الدول التى صدرت لها مصر 🇪🇬</h3> <br>",
         unsafe_allow_html=True,
     )
     sorted_df_metadata = df_metadata.sort_values(by="Export Amount", ascending=False)[:top_k_countries].reset_index()
     # print(sorted_df_metadata)
+    # Only the encoded columns are sent, the store's string columns would ship every country's name with them
     st.vega_lite_chart(
-        sorted_df_metadata,
+        charts.chart_frame(sorted_df_metadata, ["Country Code", "Export Amount"]),
         {
             "mark": {"type": "bar", "cornerRadiusEnd": 8},
             "encoding": {
@@ -143,138 +322,281 @@ with st.expander("Chapter 1: The Story of the largest countries we export to", e
     if show_legend:
         num_columns_to_split = 4
         columns = st.columns(num_columns_to_split)
-        legend = sorted_df_metadata[["Country Code", "Country Name"]]
-        legend = legend.rename(columns={"Country Code": "كود البلد", "Country Name": "أسم الدولة"})
-        splits = np.array_split(legend, num_columns_to_split)
-        for idx, legend in enumerate(splits):
-            columns[idx].markdown(legend.to_html(index=False), unsafe_allow_html=True)
+        for idx, legend_table in enumerate(load_legend_tables(top_k_countries, num_columns_to_split, dataset_version)):
+            columns[idx].markdown(legend_table, unsafe_allow_html=True)
+
+
+chapter("chapter 1", "Chapter 1: The Story of the largest countries we export to", draw_chapter_1)
+
 
 # Chapter 2: What happened in the last 10 years ?
-with st.expander("Chapter 2: What happened in the last 10 years ?", expanded=False):
+def draw_chapter_2():
     st.markdown(
         "<h3 style='direction: rtl; text-align:center;'>كم صدرنا إلى الدول المختلفة على مدار ال 10 سنين السابقة ؟ 💸</h3> <br>",
         unsafe_allow_html=True,
     )
-    countries_selected = st.multiselect("Select Countries", df_metadata["Country Name"].values, default="السعودية")
-
-    columns = st.columns(chapter2_num_columns)
-    for idx, country_selected_name in enumerate(countries_selected):
-        # Read metadata
-        country_selected_code = df_metadata.loc[
-            df_metadata["Country Name"] == country_selected_name, "Country Code"
-        ].values[0]
-        country_path = dataset_path / country_selected_code
-        country_color = df_metadata.loc[df_metadata["Country Name"] == country_selected_name, "Color"].values[0]
-
-        # Read yearly data
-        yearly_df = pd.read_csv(country_path / "yearly.csv", index_col=False)
-        yearly_df = utils.normalize_money(yearly_df, "Export Amount", "Export Value")
-
-        # Read monthly data
-        monthly_df = pd.read_csv(country_path / "monthly.csv", index_col=False)
-        monthly_df["Export Amount"] = monthly_df["Export Amount"].apply(lambda x: utils.str_money2int(x) / 1e6)
-        if not enable_aggregate:
-            monthly_df["Year"] = monthly_df.apply(lambda x: f'{x["Year"]} - {x["Month"]}', axis=1)
-
-        # Select dataframe
-        if yearly_or_monthly == "Yearly":
-            selected_df = yearly_df
-        else:
-            selected_df = monthly_df
-        selected_df.index.name = "Index"
-        
-        # Show country name
-        columns[idx % chapter2_num_columns].markdown(
-            country_name_template.format(
-                country_name=country_selected_name, country_code=country_selected_code, country_color=country_color
-            ),
-            unsafe_allow_html=True,
-        )
+    registry = load_registry(dataset_version)
+    countries_selected = country_multiselect("Select Countries", "countries_selected", default="السعودية")
+    countries = [registry.by_name(country_selected_name) for country_selected_name in countries_selected]
+
+    # Select table, monthly points are labeled and ordered by their precomputed period (in million dollars)
+    if yearly_or_monthly == "Yearly":
+        table_name, x_field, sort_field, sort_type = "yearly", "Year", "Year", "ordinal"
+    elif enable_aggregate:
+        table_name, x_field, sort_field, sort_type = "monthly", "Year", "Year", "ordinal"
+    else:
+        table_name, x_field, sort_field, sort_type = "monthly", "Period", "Date", "temporal"
+    chart_max_points = max_points if table_name == "monthly" and not enable_aggregate and max_points != "All" else None
 
-        # Show diagram options
-        if diagram_option == "Bar Chart":
-            columns[idx % chapter2_num_columns].vega_lite_chart(
-                selected_df,
-                {
-                    "mark": {"type": "bar", "cornerRadiusEnd": 8, "color": df_metadata.iloc[idx]["Color"]},
-                    "encoding": {
-                        "y": {"field": "Year", "type": "ordinal", "title": "Year", "sort": {"field": "Index"}},
-                        "x": {
-                            "field": "Export Amount",
-                            "type": "quantitative",
-                            "title": "Export Amount in Million Dollars",
-                        },
-                        "order": {"field": "Index", "type": "ordinal"},
-                    },
+    # Build diagram options, colored by country in the combined chart
+    if combine_countries:
+        color_encoding = {
+            "color": {
+                "field": "Country Name",
+                "type": "nominal",
+                "title": "Country",
+                "sort": [country.name for country in countries],
+                "scale": {
+                    "domain": [country.name for country in countries],
+                    "range": [country.color for country in countries],
                 },
-                use_container_width=True,
-            )
-        elif diagram_option == "Line Chart":
-            if enable_aggregate:
-                selected_df = selected_df.groupby("Year").sum().reset_index()
-            columns[idx % chapter2_num_columns].vega_lite_chart(
-                selected_df,
-                {
-                    "mark": {
-                        "type": "line",
-                        "point": {"filled": False, "fill": "white"},
-                        "color": df_metadata.iloc[idx]["Color"],
-                    },
-                    "encoding": {
-                        "x": {
-                            "field": "Year",
-                            "type": "ordinal",
-                            "title": "Year",
-                            "axis": {"labelAngle": -65},
-                            "sort": {"field": "Index"}
-                        },
-                        "y": {
-                            "field": "Export Amount",
-                            "type": "quantitative",
-                            "title": "Export Amount in Million Dollars",
-                        },
-                        "order": {"field": "Index", "type": "ordinal"},
-                    },
+            }
+        }
+    else:
+        color_encoding = {}
+    if diagram_option == "Bar Chart":
+        spec = {
+            "mark": {"type": "bar", "cornerRadiusEnd": 8},
+            "encoding": {
+                "y": {
+                    "field": x_field,
+                    "type": "ordinal",
+                    "title": "Year",
+                    "sort": {"field": sort_field, "op": "min"},
                 },
-                use_container_width=True,
+                "x": {
+                    "field": "Export Amount",
+                    "type": "quantitative",
+                    "title": "Export Amount in Million Dollars",
+                },
+                "order": {"field": sort_field, "type": sort_type},
+                **color_encoding,
+            },
+        }
+    elif diagram_option == "Line Chart":
+        spec = {
+            "mark": {"type": "line", "point": {"filled": False, "fill": "white"}},
+            "encoding": {
+                "x": {
+                    "field": x_field,
+                    "type": "ordinal",
+                    "title": "Year",
+                    "axis": {"labelAngle": -65},
+                    "sort": {"field": sort_field, "op": "min"},
+                },
+                "y": {
+                    "field": "Export Amount",
+                    "type": "quantitative",
+                    "title": "Export Amount in Million Dollars",
+                },
+                "order": {"field": sort_field, "type": sort_type},
+                **color_encoding,
+            },
+        }
+    else:
+        raise ValueError("Diagram option not found")
+    fields = tuple(charts.encoded_fields(spec))
+
+    if not combine_countries:
+        columns = st.columns(chapter2_num_columns)
+        for idx, country in enumerate(countries):
+            # Show country name
+            columns[idx % chapter2_num_columns].markdown(
+                country_name_template.format(
+                    country_name=country.name, country_code=country.code, country_color=country.color
+                ),
+                unsafe_allow_html=True,
             )
-        else:
-            raise ValueError("Diagram option not found")
+
+            # Show the country's diagram in its own color
+            chart_df = load_chart_frame(
+                table_name, (country.code,), fields, enable_aggregate, chart_max_points, dataset_version
+            )
+            with profiling.phase("serialize charts"):
+                columns[idx % chapter2_num_columns].vega_lite_chart(
+                    chart_df, {**spec, "mark": {**spec["mark"], "color": country.color}}, use_container_width=True
+                )
+    elif len(countries) > 0:
+        chart_df = load_chart_frame(
+            table_name,
+            tuple(country.code for country in countries),
+            fields,
+            enable_aggregate,
+            chart_max_points,
+            dataset_version,
+        )
+        with profiling.phase("serialize charts"):
+            st.vega_lite_chart(chart_df, spec, use_container_width=True)
+
+
+chapter("chapter 2", "Chapter 2: What happened in the last 10 years ?", draw_chapter_2)
+
 
 # Chapter 3: What items we export ?
-with st.expander("Chapter 3: What items we export ?", expanded=False):
+def draw_chapter_3():
     st.markdown(
         "<h3 style='direction: rtl; text-align:center;'>لماذا الغاز الطبيعى والبرتقال ؟ 🍊</h3> <br>",
         unsafe_allow_html=True,
     )
 
-    countries_picked = st.multiselect("Pick a Country", df_metadata["Country Name"].values, default="السعودية")
+    registry = load_registry(dataset_version)
+    countries_picked = country_multiselect("Pick a Country", "countries_picked", default="السعودية")
     chapter3_columns = st.columns(chapter3_num_columns)
     for idx, country_picked_name in enumerate(countries_picked):
-        country_code = df_metadata.loc[df_metadata["Country Name"] == country_picked_name, "Country Code"].values[0]
-        country_path = dataset_path / country_code
-        country_name = df_metadata.loc[df_metadata["Country Code"] == country_code, "Country Name"].values[0]
-        country_color = df_metadata.loc[df_metadata["Country Code"] == country_code, "Color"].values[0]
-        items_df = pd.read_csv(country_path / "items.csv", index_col=False)
-        items_df = utils.normalize_money(items_df, "Amount", "Value")
-        items_df.drop(columns=["Value"], inplace=True)
-        items_df["Amount"] = items_df["Amount"].apply(lambda x: f"{x:.3f}")
-        items_df.rename(columns={"Amount": "الصادرات بالمليون دولار"}, inplace=True)
-        items_df.rename(columns={"Item": "المنتجات"}, inplace=True)
-        items_df.fillna("غير معلوم", inplace=True)
-        filtered_items_df = items_df[:top_n_items] if isinstance(top_n_items, int) else items_df
+        country = registry.by_name(country_picked_name)
+        items_tables = load_items_tables(country.code, top_n_items, items_page_size, dataset_version)
 
         chapter3_columns[idx % chapter3_num_columns].markdown(
             country_name_template.format(
-                country_name=country_name, country_code=country_code, country_color=country_color
+                country_name=country.name, country_code=country.code, country_color=country.color
             ),
             unsafe_allow_html=True,
         )
+        # Only the page on screen is sent, the page slider is keyed on the page count so it resets when it changes
+        page_number = 1
+        if len(items_tables) > 1:
+            page_number = chapter3_columns[idx % chapter3_num_columns].select_slider(
+                "Page",
+                options=list(range(1, len(items_tables) + 1)),
+                key=f"items_page_{country.code}_{len(items_tables)}",
+            )
         chapter3_columns[idx % chapter3_num_columns].markdown(
-            filtered_items_df.to_html(index=False) + "<br>", unsafe_allow_html=True
+            items_tables[page_number - 1] + "<br>", unsafe_allow_html=True
+        )
+
+    # Which countries buy a product, answered from the product index instead of every items.csv
+    st.markdown(
+        "<h3 style='direction: rtl; text-align:center;'>مين بيشترى المنتج ده ؟ 🔎</h3> <br>",
+        unsafe_allow_html=True,
+    )
+    product_index = load_product_index(dataset_version)
+    product_query = st.text_input("Search for a Product", value="برتقال")
+    product_matches = product_index.find(product_query)
+    if len(product_matches) == 0:
+        st.markdown("<p>لا توجد منتجات مطابقة</p>", unsafe_allow_html=True)
+    else:
+        product = st.selectbox(
+            "Pick a Product", product_matches, format_func=lambda key: product_index.names[key], index=0
         )
+        destinations_df = product_index.destinations(product, top_n_destinations)[["Country Code", "Amount"]]
+        destinations_df = destinations_df.assign(
+            **{
+                "Country Name": destinations_df["Country Code"].map(lambda code: registry.by_code(code).name),
+                "Share": destinations_df["Amount"] / product_index.totals[product] * 100,
+            }
+        )
+        product_columns = st.columns(2)
+        product_columns[0].vega_lite_chart(
+            charts.chart_frame(destinations_df, ["Country Code", "Amount"]),
+            {
+                "mark": {"type": "bar", "cornerRadiusEnd": 8},
+                "encoding": {
+                    "x": {"field": "Country Code", "type": "nominal", "title": "Country Code", "sort": "-y"},
+                    "y": {"field": "Amount", "type": "quantitative", "title": "Export Amount in Million Dollars"},
+                },
+            },
+            use_container_width=True,
+        )
+        destinations_df = destinations_df[["Country Name", "Amount", "Share"]].rename(
+            columns={"Country Name": "أسم الدولة", "Amount": "الصادرات بالمليون دولار", "Share": "النصيب %"}
+        )
+        product_columns[1].markdown(tables.render_table(destinations_df, decimals=3), unsafe_allow_html=True)
+
+
+chapter("chapter 3", "Chapter 3: What items we export ?", draw_chapter_3)
 
-with st.expander("Chapter 4: What do you think ?", expanded=False):
+
+# Chapter 4: Who is buying more from us ?
+def draw_chapter_4():
+    st.markdown(
+        "<h3 style='direction: rtl; text-align:center;'>مين بيشترى مننا أكتر كل سنة ؟ 📈</h3> <br>",
+        unsafe_allow_html=True,
+    )
+    registry, cube = load_registry(dataset_version), load_cube(dataset_version)
+    st.vega_lite_chart(
+        aggregates.yearly_totals(cube).reset_index(),
+        {
+            "mark": {"type": "line", "point": {"filled": False, "fill": "white"}},
+            "encoding": {
+                "x": {"field": "Year", "type": "ordinal", "title": "Year"},
+                "y": {
+                    "field": "Export Amount",
+                    "type": "quantitative",
+                    "title": "Total Export Amount in Million Dollars",
+                },
+            },
+        },
+        use_container_width=True,
+    )
+
+    if start_year == end_year:
+        st.markdown("<p>Pick two different years to compare</p>", unsafe_allow_html=True)
+    else:
+        gainers, losers = aggregates.top_movers(cube, start_year, end_year, top_n_movers, movers_by)
+        movers_columns = st.columns(2)
+        for column, title, movers in zip(
+            movers_columns, ["📈 زادت صادراتنا إلى", "📉 قلت صادراتنا إلى"], [gainers, losers]
+        ):
+            movers = movers.reset_index()
+            movers["Country Code"] = movers["Country Code"].map(lambda code: registry.by_code(code).name)
+            movers = movers.rename(
+                columns={
+                    "Country Code": "أسم الدولة",
+                    "Start Amount": f"{start_year}",
+                    "End Amount": f"{end_year}",
+                    "Change": "التغير بالمليون دولار",
+                    "CAGR": "النمو السنوى %",
+                    "End Share": f"النصيب فى {end_year} %",
+                }
+            )
+            column.markdown(f"<p>{title} ({start_year} - {end_year})</p>", unsafe_allow_html=True)
+            column.markdown(tables.render_table(movers, decimals=1, na_rep="-"), unsafe_allow_html=True)
+
+
+chapter("chapter 4", "Chapter 4: Who is buying more from us ?", draw_chapter_4)
+
+
+def draw_revisions():
+    st.markdown(
+        "<h3 style='direction: rtl; text-align:center;'>إيه اللى اتغير فى البيانات ؟ 📝</h3> <br>",
+        unsafe_allow_html=True,
+    )
+    numbers = sorted(versions, reverse=True)
+    current = dataset_version.get("history", numbers[0])
+    version_columns = st.columns(2)
+    new_version = version_columns[1].selectbox(
+        "To Version", numbers, index=numbers.index(current), format_func=lambda number: f"v{number}"
+    )
+    older = [number for number in numbers if number < new_version]
+    if len(older) == 0:
+        st.markdown("<p>This is the first version, nothing to compare it with</p>", unsafe_allow_html=True)
+        return
+    old_version = version_columns[0].selectbox("From Version", older, format_func=lambda number: f"v{number}")
+    counts, diffs = load_revisions(old_version, new_version, numbers[0])
+    st.markdown(tables.render_table(counts.rename_axis("Table").reset_index(), decimals=0), unsafe_allow_html=True)
+    for name, diff_df in diffs.items():
+        if len(diff_df) > 0:
+            st.markdown(f"<p>{name} ({len(diff_df)} rows, first 50)</p>", unsafe_allow_html=True)
+            # Occurrence only tells apart items a country lists twice under the same name
+            diff_df = diff_df.drop(columns="Occurrence", errors="ignore")
+            st.markdown(tables.render_table(diff_df[:50], decimals=3), unsafe_allow_html=True)
+
+
+if len(versions) > 1:
+    chapter("revisions", "What changed in the data ?", draw_revisions)
+
+
+def draw_chapter_5():
     st.markdown(
         "<p>💝 أتمنى هذه الأداة المتواضعة تساعد شخص ما على إتخاذ قرار جيد بخصوص مشروعه القادم</p>",
         unsafe_allow_html=True,
@@ -289,7 +611,9 @@ with st.expander("Chapter 4: What do you think ?", expanded=False):
     )
 
     if enable_surprise:
-        # Download dataset zip file
+        # Download dataset zip file, only rebuilt when the dataset changes
+        with profiling.phase("zip dataset"):
+            zip_path = utils.cached_zip_directory(dataset_path, store_path / "exports_dataset.zip", latest_version)
         with open(zip_path, "rb") as fp:
             st.columns(3)[1].download_button(
                 # st.sidebar.download_button(
@@ -302,23 +626,43 @@ with st.expander("Chapter 4: What do you think ?", expanded=False):
 
     st.balloons()
 
+
+chapter("chapter 5", "Chapter 5: What do you think ?", draw_chapter_5)
+
+
+def draw_chapter_6():
+    st.markdown(
+        "<h3 style='direction: rtl; text-align:center;'> مصادر أقتصادية مفيدة 📚</h3> <br>", unsafe_allow_html=True
+    )
+    st.write(
+        '- [When Client Says "Your Price Is Too High"– How To Respond](https://www.youtube.com/watch?v=RFk8ZmIDrFM) '
+    )
+    st.write("- [Feel the Pain](https://www.youtube.com/watch?v=uWX2g0QplSg)")
+    st.write("- [How & When To Raise Your Rates (The 3x Rule)](https://www.youtube.com/watch?v=Dr4Ux8_mfU8)")
+    st.write(
+        "- [MBA in one day Book](https://www.kutubpdfbook.com/book/%D9%85%D8%A7%D8%AC%D8%B3%D8%AA%D9%8A%D8%B1-%D8%A3%D8%AF%D8%A7%D8%B1%D8%A9-%D8%A7%D9%84%D8%A7%D8%B9%D9%85%D8%A7%D9%84-%D9%81%D9%8A-%D9%8A%D9%88%D9%85-%D9%88%D8%A7%D8%AD%D8%AF)"
+    )
+    st.write("- [Why Customers Buy (Marketing Fundamentals)](https://www.youtube.com/watch?v=TVqXHVCmfHE)")
+    st.markdown(
+        "<br> <span style='text-align: right;'> هذا ملف صوتى غير مهم (لا تضيع وقتك فى سماعه)</span> <br>",
+        unsafe_allow_html=True,
+    )
+    st.audio(str(Path(__file__).parent / "assets" / "surprise.webm"), format="audio/webm")
+
+
 if enable_surprise:
     st.snow()
-    with st.expander("Chapter 5: Helpful Material", expanded=False):
-        st.markdown(
-            "<h3 style='direction: rtl; text-align:center;'> مصادر أقتصادية مفيدة 📚</h3> <br>", unsafe_allow_html=True
-        )
-        st.write(
-            '- [When Client Says "Your Price Is Too High"– How To Respond](https://www.youtube.com/watch?v=RFk8ZmIDrFM) '
-        )
-        st.write("- [Feel the Pain](https://www.youtube.com/watch?v=uWX2g0QplSg)")
-        st.write("- [How & When To Raise Your Rates (The 3x Rule)](https://www.youtube.com/watch?v=Dr4Ux8_mfU8)")
-        st.write(
-            "- [MBA in one day Book](https://www.kutubpdfbook.com/book/%D9%85%D8%A7%D8%AC%D8%B3%D8%AA%D9%8A%D8%B1-%D8%A3%D8%AF%D8%A7%D8%B1%D8%A9-%D8%A7%D9%84%D8%A7%D8%B9%D9%85%D8%A7%D9%84-%D9%81%D9%8A-%D9%8A%D9%88%D9%85-%D9%88%D8%A7%D8%AD%D8%AF)"
-        )
-        st.write("- [Why Customers Buy (Marketing Fundamentals)](https://www.youtube.com/watch?v=TVqXHVCmfHE)")
-        st.markdown(
-            "<br> <span style='text-align: right;'> هذا ملف صوتى غير مهم (لا تضيع وقتك فى سماعه)</span> <br>",
-            unsafe_allow_html=True,
-        )
-        st.audio(str(Path(__file__).parent / "assets" / "surprise.webm"), format="audio/webm")
+    chapter("chapter 6", "Chapter 6: Helpful Material", draw_chapter_6)
+
+# Export this rerun's timings, and show them at the bottom of the sidebar when asked for with ?profile=1
+profile_phases = profiling.finish_rerun()
+if profile_session and profile_phases is not None:
+    st.sidebar.markdown("""---""")
+    df_phases = pd.DataFrame(profile_phases)
+    df_phases = pd.DataFrame(
+        {"Phase": df_phases["phase"], "ms": df_phases["seconds"] * 1000, "Read KB": df_phases["read_bytes"] / 1024}
+    )
+    st.sidebar.markdown(tables.render_table(df_phases, decimals=1), unsafe_allow_html=True)
+    # Memory the shared tables of this version take in the process, against the expanded layout each process held
+    df_footprint = utils.memory_footprint({name: load_table(name, dataset_version) for name in utils.store_tables})
+    st.sidebar.markdown(tables.render_table(df_footprint.reset_index(), decimals=2), unsafe_allow_html=True)
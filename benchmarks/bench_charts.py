@@ -0,0 +1,77 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+from streamlit import type_util
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import charts
+import utils
+
+# Size of the Arrow payloads Chapter 2 sends for its monthly line charts, as they were (one full country frame
+# per chart) and through charts.py (encoded fields only, downcast, one combined chart, downsampled).
+
+base_path = Path(__file__).parent.parent
+fields = ["Period", "Export Amount", "Date", "Country Name"]
+
+
+def payload(frames):
+    # Total serialized bytes of the frames and the time spent serializing them
+    start_time = time.perf_counter()
+    size = sum(len(type_util.data_frame_to_bytes(df)) for df in frames)
+    return size, time.perf_counter() - start_time
+
+
+def legacy_frame(df):
+    # A country's frame as the store held it before strings were dictionary encoded
+    return df.astype({column: object for column, values in df.items() if values.dtype == "category"})
+
+
+def monthly_frames(monthly_df, names, country_codes, combine, max_points):
+    chart_df = monthly_df[monthly_df["Country Code"].isin(country_codes)]
+    chart_df = charts.downsample(chart_df, "Country Code", "Export Amount", max_points)
+    chart_df = chart_df.assign(**{"Country Name": chart_df["Country Code"].map(names)})
+    if combine:
+        return [charts.chart_frame(chart_df, fields)]
+    return [
+        charts.chart_frame(df, fields[:-1]) for _, df in chart_df.groupby("Country Code", sort=False, observed=True)
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Chapter 2 chart payloads")
+    parser.add_argument("--countries", type=int, nargs="+", default=[1, 5, 20, 50])
+    parser.add_argument("--max-points", type=int, default=48)
+    args = parser.parse_args()
+
+    store = utils.load_store(base_path / "dataset", base_path / "dataset_store")
+    monthly_df = store["monthly"]
+    countries_df = store["countries"].sort_values("Export Amount", ascending=False)
+    names = dict(zip(countries_df["Country Code"], countries_df["Country Name"]))
+
+    results = []
+    for num_countries in args.countries:
+        country_codes = countries_df["Country Code"].tolist()[:num_countries]
+        cases = {
+            "full frame per chart": [legacy_frame(utils.country_table(monthly_df, code)) for code in country_codes],
+            "projected per chart": monthly_frames(monthly_df, names, country_codes, False, None),
+            "one combined chart": monthly_frames(monthly_df, names, country_codes, True, None),
+            f"combined, {args.max_points} points": monthly_frames(
+                monthly_df, names, country_codes, True, args.max_points
+            ),
+        }
+        for case, frames in cases.items():
+            size, serialize_time = payload(frames)
+            results.append(
+                {
+                    "Countries": num_countries,
+                    "Payload": case,
+                    "Charts": len(frames),
+                    "Rows": sum(len(df) for df in frames),
+                    "KB": size / 1024,
+                    "Serialize ms": serialize_time * 1000,
+                }
+            )
+    print(pd.DataFrame(results).set_index(["Countries", "Payload"]).round(1).to_string())
@@ -0,0 +1,81 @@
+import argparse
+import sys
+import timeit
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import utils
+
+warnings.filterwarnings("ignore")
+
+# Compares the vectorized money normalization in utils.py with the functions it replaced,
+# on every items/yearly/monthly row of the dataset concatenated into one frame per table.
+
+dataset_path = Path(__file__).parent.parent / "dataset"
+
+
+def legacy_normalize_money(df, money_column_name, value_column_name, normalize_to="مليون"):
+    values_dict = {"مليون": 1000000, "ألف": 1000, "مليار": 1000000000}
+    df[value_column_name].fillna("لا شئ", inplace=True)
+    for key, value in values_dict.items():
+        if value != "لا شئ":
+            df.loc[df[value_column_name].str.contains(key), money_column_name] = df[money_column_name] * value / values_dict[normalize_to]
+
+    return df
+
+
+def legacy_parse_monthly(values):
+    return values.apply(lambda x: utils.str_money2int(x) / 1e6)
+
+
+def read_table(name):
+    frames = [pd.read_csv(path / f"{name}.csv", index_col=False) for path in sorted(dataset_path.iterdir()) if path.is_dir()]
+    return pd.concat(frames, ignore_index=True)
+
+
+def bench(function, number):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark money normalization on the full dataset")
+    parser.add_argument("--number", type=int, default=10)
+    args = parser.parse_args()
+
+    items_df = read_table("items")
+    yearly_df = read_table("yearly")
+    monthly_df = read_table("monthly")
+    monthly_amounts = monthly_df["Export Amount"].astype(str)
+
+    cases = {
+        f"items normalize_money ({len(items_df)} rows)": (
+            lambda: legacy_normalize_money(items_df.copy(), "Amount", "Value")["Amount"],
+            lambda: utils.normalize_money(items_df, "Amount", "Value")["Amount"],
+        ),
+        f"yearly normalize_money ({len(yearly_df)} rows)": (
+            lambda: legacy_normalize_money(yearly_df.copy(), "Export Amount", "Export Value")["Export Amount"],
+            lambda: utils.normalize_money(yearly_df, "Export Amount", "Export Value")["Export Amount"],
+        ),
+        f"monthly amounts ({len(monthly_df)} rows)": (
+            lambda: legacy_parse_monthly(monthly_amounts),
+            lambda: utils.parse_money_column(monthly_amounts) / 1e6,
+        ),
+    }
+
+    results = []
+    for name, (legacy, vectorized) in cases.items():
+        np.testing.assert_array_equal(legacy().to_numpy(dtype="float64"), vectorized().to_numpy(dtype="float64"))
+        legacy_time, vectorized_time = bench(legacy, args.number), bench(vectorized, args.number)
+        results.append(
+            {
+                "Case": name,
+                "Legacy ms": legacy_time * 1000,
+                "Vectorized ms": vectorized_time * 1000,
+                "Speedup": legacy_time / vectorized_time,
+            }
+        )
+    print(pd.DataFrame(results).set_index("Case").round(2).to_string())
@@ -0,0 +1,93 @@
+import argparse
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from pathlib import Path
+
+import pandas as pd
+from bs4 import BeautifulSoup
+from lxml import etree
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import stand_in
+import utils
+
+warnings.filterwarnings("ignore")
+
+# Compares the old BeautifulSoup -> str -> lxml parse with the single pass parser on saved pages.
+# Pages are rendered from the dataset when no saved pages folder is given.
+
+
+def old_path(content, country_path):
+    soup = BeautifulSoup(content.decode("utf-8"), "html.parser")
+    dom = etree.HTML(str(soup))
+    dom.xpath("//h3/span/span[@class='text-primary']/text()")[0]
+    utils.parse_money(dom.xpath("//div/span[@class='text-primary']/text()")[0])
+    utils.extract_items_data(dom, country_path / "items.csv")
+    utils.extract_yearly_data(dom, country_path / "yearly.csv")
+    utils.extract_monthly_yearly_data(dom, country_path / "monthly.csv")
+
+
+def new_path(content, country_path):
+    page = utils.parse_country_page(content)
+    utils.parse_money(page["total_export_text"])
+    utils.write_country_page(page, country_path)
+
+
+def measure(function, content, country_path, repeat):
+    best_time = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function(content, country_path)
+        best_time = min(best_time, time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    function(content, country_path)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best_time, peak_memory
+
+
+def run(pages_dir, repeat=3):
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        output_dir = Path(output_dir)
+        for page_file in sorted(pages_dir.glob("*.html")):
+            content = page_file.read_bytes()
+            old_time, old_memory = measure(old_path, content, output_dir, repeat)
+            new_time, new_memory = measure(new_path, content, output_dir, repeat)
+            results.append(
+                {
+                    "Country Code": page_file.stem,
+                    "KB": len(content) / 1024,
+                    "Old ms": old_time * 1000,
+                    "New ms": new_time * 1000,
+                    "Old peak KB": old_memory / 1024,
+                    "New peak KB": new_memory / 1024,
+                }
+            )
+    df_results = pd.DataFrame(results).set_index("Country Code").sort_values("KB", ascending=False)
+    df_results["Speedup"] = df_results["Old ms"] / df_results["New ms"]
+    return df_results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark country page parsing")
+    parser.add_argument("--pages", type=Path, default=None, help="Folder of saved <ISO3>.html pages")
+    parser.add_argument("--countries", nargs="+", default=None, help="Only render these countries")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as rendered_dir:
+        pages_dir = args.pages
+        if pages_dir is None:
+            pages_dir = Path(rendered_dir)
+            stand_in.save_pages(pages_dir, args.countries)
+        df_results = run(pages_dir, args.repeat)
+
+    print(df_results.round(2).to_string())
+    totals = df_results.sum()
+    print(f"\nTotal: old {totals['Old ms']:.0f} ms, new {totals['New ms']:.0f} ms ({totals['Old ms'] / totals['New ms']:.1f}x)")
+    print(f"Worst peak memory: old {df_results['Old peak KB'].max():.0f} KB, new {df_results['New peak KB'].max():.0f} KB")
@@ -0,0 +1,90 @@
+import argparse
+import difflib
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import search
+import utils
+
+# Query latency of search.FuzzyIndex over every item name in the dataset, against a linear substring
+# scan and difflib, for as-you-type prefixes, words with a typo and multi-word queries.
+
+base_path = Path(__file__).parent.parent
+
+
+def make_queries(names, count, seed=0):
+    rng = random.Random(seed)
+    queries = {"prefix": [], "typo": [], "multi-word": []}
+    for _ in range(count):
+        words = search.normalize_arabic(rng.choice(names)).split()
+        word = rng.choice(words)
+        queries["prefix"].append(word[: rng.randint(2, max(len(word), 2))])
+        position = rng.randrange(len(word))
+        queries["typo"].append(word[:position] + word[position + 1 :] if len(word) > 3 else word)
+        queries["multi-word"].append(" ".join(words[:3]))
+    return queries
+
+
+def substring_scan(keys, query, limit=10):
+    query = search.normalize_arabic(query)
+    return [key for key in keys if query in key][:limit]
+
+
+def close_matches(keys, query, limit=10):
+    return difflib.get_close_matches(search.normalize_arabic(query), keys, n=limit, cutoff=0.5)
+
+
+def latencies(function, queries):
+    times = []
+    for query in queries:
+        start_time = time.perf_counter()
+        function(query)
+        times.append(time.perf_counter() - start_time)
+    return np.array(times) * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark fuzzy search over all item names")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--all-rows", action="store_true", help="Index every item row instead of distinct products")
+    args = parser.parse_args()
+
+    store = utils.load_store(base_path / "dataset", base_path / "dataset_store")
+    items_df = store["items"].dropna(subset=["Item"])
+    if args.all_rows:
+        names, weights = items_df["Item"].tolist(), items_df["Amount"].tolist()
+    else:
+        products_df = items_df.groupby("Item", as_index=False)["Amount"].sum()
+        names, weights = products_df["Item"].tolist(), products_df["Amount"].tolist()
+
+    start_time = time.perf_counter()
+    index = search.FuzzyIndex(names, weights=weights)
+    print(f"Indexed {len(index)} names in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+    keys = index.keys
+
+    engines = {
+        "FuzzyIndex": lambda query: index.search(query),
+        "substring scan": lambda query: substring_scan(keys, query),
+        "difflib": lambda query: close_matches(keys, query),
+    }
+    results = []
+    for kind, queries in make_queries(names, args.queries).items():
+        for engine, function in engines.items():
+            # difflib takes tens of milliseconds per query, a sample is enough
+            times = latencies(function, queries if engine != "difflib" else queries[:20])
+            results.append(
+                {
+                    "Queries": kind,
+                    "Engine": engine,
+                    "p50 us": np.percentile(times, 50),
+                    "p95 us": np.percentile(times, 95),
+                    "max us": times.max(),
+                }
+            )
+    print(pd.DataFrame(results).set_index(["Queries", "Engine"]).round(1).to_string())
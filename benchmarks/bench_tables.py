@@ -0,0 +1,60 @@
+import argparse
+import re
+import sys
+import timeit
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import tables
+import utils
+
+# Compares the Chapter 3 items table as it was rendered (per-row amount formatting + DataFrame.to_html) with
+# tables.render_table, for the countries with the most items, whole table and one page.
+
+base_path = Path(__file__).parent.parent
+
+
+def legacy_render(items_df):
+    # Strings as objects, as the store held them before they were dictionary encoded
+    items_df = items_df.astype({column: object for column, values in items_df.items() if values.dtype == "category"})
+    items_df["Amount"] = items_df["Amount"].apply(lambda x: f"{x:.3f}")
+    items_df.fillna("غير معلوم", inplace=True)
+    return items_df.to_html(index=False)
+
+
+def bench(function, number):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark items table rendering")
+    parser.add_argument("--countries", type=int, default=5)
+    parser.add_argument("--page-size", type=int, default=25)
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+
+    items_df = utils.load_store(base_path / "dataset", base_path / "dataset_store")["items"]
+    results = []
+    for country_code in items_df["Country Code"].value_counts().index[: args.countries]:
+        country_items_df = utils.country_table(items_df, country_code)[["Item", "Amount"]]
+        legacy_html = legacy_render(country_items_df)
+        new_html = tables.render_table(country_items_df, decimals=3, na_rep="غير معلوم")
+        # Same table, to_html only adds indentation
+        assert re.sub(r"\s+", "", legacy_html) == re.sub(r"\s+", "", new_html)
+        page_df = tables.pages(country_items_df, args.page_size)[0]
+        results.append(
+            {
+                "Country Code": country_code,
+                "Rows": len(country_items_df),
+                "to_html ms": bench(lambda: legacy_render(country_items_df), args.number) * 1000,
+                "render_table ms": bench(
+                    lambda: tables.render_table(country_items_df, decimals=3, na_rep="غير معلوم"), args.number
+                )
+                * 1000,
+                "to_html KB": len(legacy_html.encode()) / 1024,
+                "Page KB": len(tables.render_table(page_df, decimals=3, na_rep="غير معلوم").encode()) / 1024,
+            }
+        )
+    print(pd.DataFrame(results).set_index("Country Code").round(2).to_string())
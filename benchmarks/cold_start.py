@@ -0,0 +1,84 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Cold start of the app as a freshly scaled-up container sees it: every run is a new interpreter that imports
+# streamlit and the app's modules and serves one first rerun with empty caches, all chapters closed. First paint
+# is the time from spawning the process until that rerun is done, which is compared with a budget.
+
+base_path = Path(__file__).parent.parent
+# Seconds from process start to the first rerun done, on the machine benchmarks/baseline.json was saved on
+first_paint_budget = 2.0
+
+
+def child(spawn_time):
+    # Runs in the spawned interpreter: time the imports and the first rerun, report them as one JSON line
+    start_time = time.perf_counter()
+    import streamlit  # noqa: F401
+
+    sys.path.insert(0, str(Path(__file__).parent))
+    import suite
+
+    imported_time = time.perf_counter()
+    runner = suite.app_runner()()
+    end_time = time.perf_counter()
+    messages = runner.forward_msgs()
+    print(
+        json.dumps(
+            {
+                "interpreter_s": start_time - spawn_time,
+                "imports_s": imported_time - start_time,
+                "rerun_s": end_time - imported_time,
+                "first_paint_s": end_time - spawn_time,
+                "messages": len(messages),
+                "payload_kb": sum(message.ByteSize() for message in messages) / 1024,
+            }
+        )
+    )
+
+
+def cold_start(profile_dir):
+    # One fresh process, profiled so the phases of its rerun land in profile_dir/reruns.jsonl
+    env = {**os.environ, "EXPORTS_PROFILE": "1", "EXPORTS_PROFILE_DIR": str(profile_dir)}
+    spawn_time = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", repr(spawn_time)], env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the app's cold start in fresh processes against a budget")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=first_paint_budget, help="Median first paint allowed, seconds")
+    parser.add_argument("--child", type=float, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        # perf_counter is system-wide on Linux, so the parent's spawn time can be compared with the child's clock
+        child(args.child)
+        sys.exit(0)
+
+    # Only imported here so the spawned processes don't count it before the app imports it
+    import pandas as pd
+
+    profile_dir = Path(tempfile.mkdtemp())
+    df_runs = pd.DataFrame([cold_start(profile_dir) for _ in range(args.runs)])
+    print(df_runs.round(3).to_string())
+
+    phases = [json.loads(line)["phases"] for line in (profile_dir / "reruns.jsonl").read_text().splitlines()]
+    df_phases = pd.DataFrame([phase for rerun in phases for phase in rerun])
+    print("\nMedian ms per phase of the first rerun:")
+    print((df_phases.groupby("phase", sort=False)["seconds"].median() * 1000).round(1).to_string())
+
+    first_paint = statistics.median(df_runs["first_paint_s"])
+    print(f"\nFirst paint: median {first_paint:.2f}s, budget {args.budget:.2f}s")
+    if first_paint > args.budget:
+        print("Cold start over budget")
+        sys.exit(1)
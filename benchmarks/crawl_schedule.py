@@ -0,0 +1,75 @@
+import argparse
+import json
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+base_path = Path(__file__).parent.parent
+sys.path.insert(0, str(base_path))
+
+import collect_data  # noqa: E402
+import crawl_hscodes  # noqa: E402
+import stand_in  # noqa: E402
+import utils  # noqa: E402
+
+# Offline check of the HS drill-down crawler against the stand-in server: crawls the top countries' chapter pages
+# into a temporary folder and reads back what the server saw, failing when more requests were in flight or arrived
+# within one second than the crawler's limits allow. Throughput is then bound by --rate, not by the server.
+
+
+def run(countries, hscodes, rate, burst, workers, delay):
+    server = stand_in.serve(port=0, delay=delay, background=True)
+    url = f"http://127.0.0.1:{server.server_port}/map/country-info?hscode={{hscode}}&iso3={{country_code}}"
+    try:
+        work = crawl_hscodes.plan(
+            collect_data.country_codes, hscodes, base_path / "dataset" / "metadata.json", countries
+        )
+        with tempfile.TemporaryDirectory() as dataset_path:
+            start_time = time.perf_counter()
+            timings = crawl_hscodes.crawl(
+                work, dataset_path, url, rate=rate, burst=burst, workers=workers, max_per_host=workers
+            )
+            wall_time = time.perf_counter() - start_time
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/stats") as response:
+            stats = json.load(response)
+    finally:
+        server.shutdown()
+        server.server_close()
+    failed = sum(timing["state"] == "failed" for timing in timings)
+    return {
+        "pages": len(timings),
+        "failed": failed,
+        "seconds": wall_time,
+        "pages_per_s": len(timings) / wall_time,
+        **stats,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the HS crawler's throughput and politeness limits offline")
+    parser.add_argument("--countries", type=int, default=5, help="Top N export destinations")
+    parser.add_argument("--hscodes", type=int, default=20, help="First N HS chapters")
+    parser.add_argument("--rate", type=float, default=20.0)
+    parser.add_argument("--burst", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--delay", type=float, default=0.1, help="Server latency per request, seconds")
+    args = parser.parse_args()
+
+    hscodes = utils.hs_chapters[: args.hscodes]
+    result = run(args.countries, hscodes, args.rate, args.burst, args.workers, args.delay)
+    print(json.dumps({key: round(value, 3) for key, value in result.items()}, indent=2))
+
+    # Within any one second the bucket can hand out its burst plus a second worth of tokens
+    violations = []
+    if result["max_in_flight"] > args.workers:
+        violations.append(f"{result['max_in_flight']} requests in flight, limit {args.workers}")
+    if result["max_per_second"] > args.rate + args.burst:
+        violations.append(f"{result['max_per_second']} requests in one second, limit {args.rate + args.burst:g}")
+    if result["failed"]:
+        violations.append(f"{result['failed']} pages failed")
+    for violation in violations:
+        print(violation)
+    if violations:
+        sys.exit(1)
@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from urllib.parse import urlencode
+
+import numpy as np
+import pandas as pd
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import utils
+
+# Load test for api.py: a fixed number of requests over a mix of endpoints with bounded concurrency, against a
+# running API (--url) or one started in a subprocess. --revalidate sends If-None-Match with the ETag last seen
+# for every URL like a dashboard polling for changes, --unique adds a throwaway parameter so every request misses
+# the response cache.
+
+base_path = Path(__file__).parent.parent
+
+
+def make_paths(count, unique=False, seed=0):
+    rng = random.Random(seed)
+    store = utils.load_store(base_path / "dataset", base_path / "dataset_store")
+    codes = store["countries"]["Country Code"].tolist()
+    years = sorted(store["yearly"]["Year"].unique().tolist())
+    words = [word for item in store["products"]["Item"].head(2000) for word in str(item).split() if len(word) > 3]
+    paths = []
+    for idx in range(count):
+        code = rng.choice(codes)
+        kind, endpoint, params = rng.choice(
+            [
+                ("countries", "/api/countries", {}),
+                ("yearly", f"/api/countries/{code}/yearly", {}),
+                ("monthly", f"/api/countries/{code}/monthly", {}),
+                ("items", f"/api/countries/{code}/items", {"top": rng.choice([10, 20])}),
+                ("totals", "/api/aggregates/totals", {}),
+                ("shares", "/api/aggregates/shares", {"year": rng.choice(years)}),
+                ("movers", "/api/aggregates/movers", {"start": years[0], "end": rng.choice(years[1:]), "n": 10}),
+                ("products", "/api/products", {"q": rng.choice(words)[: rng.randint(3, 6)]}),
+            ]
+        )
+        if unique:
+            params["request"] = idx
+        paths.append((kind, endpoint + ("?" + urlencode(params) if params else "")))
+    return paths
+
+
+async def run(url, paths, concurrency, revalidate):
+    client = AsyncHTTPClient(max_clients=concurrency)
+    etags, results = {}, []
+    queue = iter(paths)
+
+    async def worker():
+        for kind, path in queue:
+            headers = {"If-None-Match": etags[path]} if revalidate and path in etags else {}
+            start_time = time.perf_counter()
+            try:
+                response = await client.fetch(url + path, headers=headers, raise_error=False)
+                status, size = response.code, len(response.body or b"")
+                etags[path] = response.headers.get("Etag", "")
+            except HTTPClientError as error:
+                status, size = error.code, 0
+            results.append(
+                {"Endpoint": kind, "Status": status, "Bytes": size, "Latency": time.perf_counter() - start_time}
+            )
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return pd.DataFrame(results), time.perf_counter() - start_time
+
+
+def wait_for(url, timeout=60):
+    import requests
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url + "/api/version", timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise TimeoutError(f"API at {url} did not start")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the dataset API")
+    parser.add_argument("--url", default=None, help="Base URL of a running API, started locally if not given")
+    parser.add_argument("--port", type=int, default=8601)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--revalidate", action="store_true", help="Send If-None-Match with the last ETag seen")
+    parser.add_argument("--unique", action="store_true", help="Make every URL unique so nothing is served from cache")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        url = f"http://127.0.0.1:{args.port}"
+        server = subprocess.Popen([sys.executable, str(base_path / "api.py"), "--port", str(args.port)])
+    try:
+        wait_for(url)
+        paths = make_paths(args.requests, args.unique)
+        df_results, wall_time = asyncio.run(run(url, paths, args.concurrency, args.revalidate))
+    finally:
+        if server is not None:
+            server.terminate()
+
+    latencies = df_results.groupby("Endpoint")["Latency"]
+    summary = pd.DataFrame(
+        {
+            "Requests": latencies.size(),
+            "p50 ms": latencies.quantile(0.5) * 1000,
+            "p95 ms": latencies.quantile(0.95) * 1000,
+            "p99 ms": latencies.quantile(0.99) * 1000,
+            "KB": df_results.groupby("Endpoint")["Bytes"].mean() / 1024,
+        }
+    )
+    print(summary.round(2).to_string())
+    print(f"\nStatus codes: {dict(Counter(df_results['Status']))}")
+    print(
+        f"{len(df_results)} requests in {wall_time:.2f} s: {len(df_results) / wall_time:.0f} req/s, "
+        f"p50 {np.percentile(df_results['Latency'], 50) * 1000:.1f} ms, "
+        f"p99 {np.percentile(df_results['Latency'], 99) * 1000:.1f} ms"
+    )
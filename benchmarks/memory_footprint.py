@@ -0,0 +1,52 @@
+import argparse
+import os
+import sys
+from pathlib import Path
+
+base_path = Path(__file__).parent.parent
+sys.path.insert(0, str(base_path))
+
+import utils  # noqa: E402
+
+# Memory the store takes once resident in a process, as every app.py session shares it: the compact tables
+# (dictionary encoded strings, float32 amounts, int16 years) against the same tables expanded to object strings,
+# float64 and int64, the way each process held them before. The resident set is read before and after loading,
+# numeric columns and category codes stay in the page cache as views of the memory mapped files.
+
+# Megabytes all tables may take in a process, on the dataset checked in
+footprint_budget = 2.5
+
+
+def resident_mb():
+    # Resident set of this process from /proc, None where there is none
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the memory footprint of the store loaded in a process")
+    parser.add_argument("--dataset", type=Path, default=base_path / "dataset")
+    parser.add_argument("--store", type=Path, default=base_path / "dataset_store")
+    parser.add_argument("--budget", type=float, default=footprint_budget, help="Megabytes the tables may take")
+    args = parser.parse_args()
+
+    # Build the store first so loading it below only maps and converts the files
+    utils.load_store(args.dataset, args.store, tables=())
+    before = resident_mb()
+    tables = utils.load_store(args.dataset, args.store)
+    after = resident_mb()
+
+    df_footprint = utils.memory_footprint(tables)
+    df_footprint.loc["total"] = df_footprint.sum()
+    print(df_footprint.round(3).to_string())
+    if before is not None:
+        print(f"\nResident set grew by {after - before:.1f} MB loading the store")
+    total = df_footprint.loc["total"]
+    print(f"Tables take {total['MB']:.2f} MB, {total['Expanded MB'] / total['MB']:.1f}x less than expanded")
+    print(f"Budget {args.budget:.2f} MB")
+    if total["MB"] > args.budget:
+        print("Store footprint over budget")
+        sys.exit(1)
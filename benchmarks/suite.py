@@ -0,0 +1,363 @@
+import argparse
+import fnmatch
+import json
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+import aggregates
+import charts
+import collect_data
+import history
+import pipeline
+import search
+import snapshots
+import tables
+import utils
+
+warnings.filterwarnings("ignore")
+
+# Benchmark suite over the hot paths of the crawler, the store and the app: parsing the saved pages in
+# fixtures/, loading and normalizing the real dataset, and headless reruns of app.py. Every case reports its
+# median and best time and its peak traced memory, and is compared with baseline.json to flag regressions.
+# The fixtures are stand-in renderings (stand_in.save_pages) of three countries, biggest to smallest.
+
+base_path = Path(__file__).parent.parent
+fixtures_path = Path(__file__).parent / "fixtures"
+baseline_file = Path(__file__).parent / "baseline.json"
+dataset_path = base_path / "dataset"
+store_path = base_path / "dataset_store"
+
+# Every case is a function doing its setup and returning the callable to time
+cases = {}
+
+
+def case(name):
+    def register(function):
+        cases[name] = function
+        return function
+
+    return register
+
+
+def read_table(name):
+    frames = [
+        pd.read_csv(path / f"{name}.csv", index_col=False) for path in sorted(dataset_path.iterdir()) if path.is_dir()
+    ]
+    return pd.concat(frames, ignore_index=True)
+
+
+@case("crawl/parse_country_page")
+def parse_pages():
+    pages = [path.read_bytes() for path in sorted(fixtures_path.glob("*.html"))]
+    return lambda: [utils.parse_country_page(page) for page in pages]
+
+
+@case("crawl/extract_tables")
+def extract_tables():
+    from lxml import etree
+
+    output_dir = Path(tempfile.mkdtemp())
+    doms = [etree.HTML(path.read_bytes()) for path in sorted(fixtures_path.glob("*.html"))]
+
+    def run():
+        for dom in doms:
+            utils.extract_items_data(dom, output_dir / "items.csv")
+            utils.extract_yearly_data(dom, output_dir / "yearly.csv")
+            utils.extract_monthly_yearly_data(dom, output_dir / "monthly.csv")
+
+    return run
+
+
+@case("crawl/write_country_page")
+def write_pages():
+    output_dir = Path(tempfile.mkdtemp())
+    pages = [utils.parse_country_page(path.read_bytes()) for path in sorted(fixtures_path.glob("*.html"))]
+    return lambda: [utils.write_country_page(page, output_dir) for page in pages]
+
+
+@case("crawl/reparse_snapshots")
+def reparse_snapshots():
+    # Rebuild the fixture countries from a snapshot store, reading, parsing and writing them as collect_data does
+    snapshot_store = snapshots.SnapshotStore(tempfile.mkdtemp())
+    country_codes = [path.stem for path in sorted(fixtures_path.glob("*.html"))]
+    for country_code in country_codes:
+        url = collect_data.base_url.format(country_code=country_code)
+        snapshot_store.put(url, (fixtures_path / f"{country_code}.html").read_bytes(), "utf-8", country_code)
+    output_dir = Path(tempfile.mkdtemp())
+    return lambda: collect_data.reparse(country_codes, output_dir, snapshot_store, workers=1)
+
+
+@case("store/normalize_money")
+def normalize_money():
+    items_df, yearly_df = read_table("items"), read_table("yearly")
+    return lambda: (
+        utils.normalize_money(items_df, "Amount", "Value"),
+        utils.normalize_money(yearly_df, "Export Amount", "Export Value"),
+    )
+
+
+@case("store/parse_money_column")
+def parse_money_column():
+    monthly_amounts = read_table("monthly")["Export Amount"].astype(str)
+    return lambda: utils.parse_money_column(monthly_amounts)
+
+
+@case("store/dataset_signature")
+def dataset_signature():
+    return lambda: utils.dataset_signature(dataset_path)
+
+
+@case("store/build_store")
+def build_store():
+    output_dir = Path(tempfile.mkdtemp())
+    return lambda: utils.build_store(dataset_path, output_dir)
+
+
+@case("store/validate")
+def validate():
+    country_paths = sorted(path for path in dataset_path.iterdir() if path.is_dir())
+    return lambda: pipeline.check_countries(country_paths)
+
+
+@case("store/load_store")
+def load_store():
+    utils.load_store(dataset_path, store_path)
+    return lambda: utils.load_store(dataset_path, store_path)
+
+
+@case("store/zip_directory")
+def zip_directory():
+    output_file = Path(tempfile.mkdtemp()) / "dataset.zip"
+    return lambda: utils.zip_directory(dataset_path, output_file)
+
+
+def comparable(df):
+    # Store tables with categories as plain values, categories are numbered differently by every build
+    return df.astype({column: object for column, values in df.items() if values.dtype == "category"})
+
+
+@case("store/history_load")
+def history_load():
+    # Two builds of a copy of the dataset, the second with an edited value, a removed country and an added item.
+    # Every version loaded back from the history must be the store that was built as it, then loading the second
+    # one (replaying its delta on the checkpoint) is timed.
+    history_dataset_path = Path(tempfile.mkdtemp()) / "dataset"
+    history_store_path = history_dataset_path.with_name("dataset_store")
+    shutil.copytree(dataset_path, history_dataset_path)
+    built = {}
+    pipeline.build(history_dataset_path, history_store_path, workers=1)
+    built[1] = utils.load_store(history_dataset_path, history_store_path)
+
+    yearly_file = history_dataset_path / "ITA" / "yearly.csv"
+    yearly_file.write_text(yearly_file.read_text(encoding="utf-8").replace("2012,1.3,", "2012,1.7,"), encoding="utf-8")
+    shutil.rmtree(history_dataset_path / "ALB")
+    with open(history_dataset_path / "SAU" / "items.csv", "a", encoding="utf-8") as f:
+        f.write("صنف للتجربة,0.5,ألف دولار\n")
+    report = pipeline.build(history_dataset_path, history_store_path, workers=1)
+    built[report["history_version"]] = utils.load_store(history_dataset_path, history_store_path)
+    if sorted(built) != [1, 2]:
+        raise AssertionError(f"Expected versions 1 and 2 to be recorded, got {sorted(built)}")
+
+    history_path = history.default_history_path(history_store_path)
+    for version, store_tables in built.items():
+        loaded = history.History(history_path).load(version)
+        for name, df in store_tables.items():
+            try:
+                pd.testing.assert_frame_equal(comparable(loaded[name]), comparable(df))
+            except AssertionError as error:
+                raise AssertionError(f"History version {version} doesn't match its store in {name}: {error}")
+    return lambda: history.History(history_path).load(2)
+
+
+@case("queries/indexes")
+def indexes():
+    store = utils.load_store(dataset_path, store_path)
+    return lambda: (
+        utils.CountryRegistry(store["countries"]),
+        search.ProductIndex(store["products"]),
+        aggregates.yearly_cube(store["yearly"]),
+    )
+
+
+@case("queries/product_search")
+def product_search():
+    product_index = search.ProductIndex(utils.load_store(dataset_path, store_path)["products"])
+    queries = ["برتقال", "برتكال", "بطاطس مجمدة", "حديد", "اسمدة", "سجاد يدوي", "ملابس قطن", "فراوله"]
+    return lambda: [product_index.find(query) for query in queries]
+
+
+@case("queries/top_movers")
+def top_movers():
+    cube = aggregates.yearly_cube(utils.load_store(dataset_path, store_path)["yearly"])
+    years = list(cube.columns)
+    return lambda: [aggregates.top_movers(cube, years[0], end_year, 10, "CAGR") for end_year in years[1:]]
+
+
+@case("render/chart_frames")
+def chart_frames():
+    monthly_df = utils.load_store(dataset_path, store_path)["monthly"]
+    country_codes = monthly_df["Country Code"].unique()[:20]
+
+    def run():
+        chart_df = monthly_df[monthly_df["Country Code"].isin(country_codes)]
+        chart_df = charts.downsample(chart_df, "Country Code", "Export Amount", 48)
+        return charts.chart_frame(chart_df, ["Period", "Export Amount", "Date", "Country Code"])
+
+    return run
+
+
+@case("render/items_tables")
+def items_tables():
+    items_df = utils.load_store(dataset_path, store_path)["items"]
+    country_items = [utils.country_table(items_df, code) for code in items_df["Country Code"].value_counts().index[:5]]
+    return lambda: [[tables.render_table(page) for page in tables.pages(df, 25)] for df in country_items]
+
+
+def app_runner():
+    # Headless reruns of app.py through streamlit's local script runner, with a stand-in runtime for media files
+    from unittest.mock import MagicMock
+
+    import streamlit as st
+    import streamlit.testing.local_script_runner as local_script_runner
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+
+    if Runtime._instance is None:
+        runtime = MagicMock(spec=Runtime)
+        runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/media"))
+        Runtime._instance = runtime
+    require_widgets_deltas = local_script_runner.require_widgets_deltas
+    local_script_runner.require_widgets_deltas = lambda runner, timeout=3: require_widgets_deltas(runner, 120)
+
+    def run(session_state=None, clear_caches=False):
+        if clear_caches:
+            # Without a runtime, clearing outside a script run doesn't warn about the missing script context
+            runtime, Runtime._instance = Runtime._instance, None
+            st.cache_data.clear()
+            st.cache_resource.clear()
+            Runtime._instance = runtime
+        runner = local_script_runner.LocalScriptRunner(str(base_path / "app.py"), prev_session_state=session_state)
+        runner.run()
+        runner.request_stop()
+        runner.join()
+        if len(runner.script_thread_exceptions) > 0:
+            raise runner.script_thread_exceptions[0]
+        # Errors raised by app.py itself are caught by Streamlit and sent as exception elements, a broken app must
+        # fail the case rather than be timed
+        for message in runner.forward_msgs():
+            if message.WhichOneof("type") == "delta" and message.delta.WhichOneof("type") == "new_element":
+                element = message.delta.new_element
+                if element.WhichOneof("type") == "exception":
+                    stack_trace = "\n".join(element.exception.stack_trace)
+                    raise RuntimeError(
+                        f"app.py raised {element.exception.type}: {element.exception.message}\n{stack_trace}"
+                    )
+        return runner
+
+    return run
+
+
+@case("app/cold_rerun")
+def app_cold_rerun():
+    run = app_runner()
+    return lambda: run(clear_caches=True)
+
+
+@case("app/warm_rerun")
+def app_warm_rerun():
+    run = app_runner()
+    session_state = run().session_state
+    return lambda: run(session_state)
+
+
+@case("app/open_rerun")
+def app_open_rerun():
+    # Same as a warm rerun with every chapter opened, chapters are not computed while closed
+    from streamlit.runtime.state import SessionState
+
+    run = app_runner()
+    session_state = SessionState()
+    for number in range(1, 6):
+        session_state[f"chapter_{number}"] = True
+    session_state = run(session_state).session_state
+    return lambda: run(session_state)
+
+
+def measure(function, repeat):
+    # Median and best of repeat timed calls after a warm-up call, then one call under tracemalloc for peak memory
+    function()
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"median_ms": statistics.median(times) * 1000, "best_ms": min(times) * 1000, "peak_kb": peak_memory / 1024}
+
+
+def compare(results, baseline, tolerance):
+    # Regression when a case got slower or hungrier than tolerance allows, ignoring sub-millisecond noise
+    rows = []
+    for name, result in results.items():
+        row = {"Case": name, **result, "Status": "new"}
+        if name in baseline:
+            time_ratio = result["median_ms"] / baseline[name]["median_ms"]
+            memory_ratio = result["peak_kb"] / max(baseline[name]["peak_kb"], 1)
+            row["Time x"], row["Memory x"] = time_ratio, memory_ratio
+            slower = time_ratio > 1 + tolerance and result["median_ms"] - baseline[name]["median_ms"] > 1
+            hungrier = memory_ratio > 1 + tolerance and result["peak_kb"] - baseline[name]["peak_kb"] > 64
+            row["Status"] = "REGRESSION" if slower or hungrier else "ok"
+        rows.append(row)
+    return pd.DataFrame(rows).set_index("Case")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the benchmark suite and compare it with the stored baseline")
+    parser.add_argument("cases", nargs="*", default=["*"], help="Glob patterns of cases to run, e.g. 'store/*'")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before flagging, 0.25 = 25%%")
+    parser.add_argument("--baseline", type=Path, default=baseline_file)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--list", action="store_true", help="List the cases and exit")
+    args = parser.parse_args()
+
+    selected = [name for name in cases if any(fnmatch.fnmatch(name, pattern) for pattern in args.cases)]
+    if args.list:
+        print("\n".join(selected))
+        sys.exit(0)
+
+    results = {}
+    for name in selected:
+        print(f"Running {name}", file=sys.stderr)
+        results[name] = measure(cases[name](), args.repeat)
+
+    baseline = json.loads(args.baseline.read_text())["cases"] if args.baseline.exists() else {}
+    df_results = compare(results, baseline, args.tolerance)
+    print(df_results.round(2).to_string())
+
+    if args.save_baseline:
+        baseline.update(results)
+        machine = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+        }
+        args.baseline.write_text(json.dumps({"machine": machine, "cases": baseline}, indent=2, sort_keys=True))
+        print(f"Saved baseline to {args.baseline}")
+    elif (df_results["Status"] == "REGRESSION").any():
+        print("Regressions against the baseline found")
+        sys.exit(1)
@@ -0,0 +1,38 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import history
+import pipeline
+
+base_path = Path(__file__).parent
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate dataset/ and compile it into the store used by the app")
+    parser.add_argument("--dataset", type=Path, default=base_path / "dataset")
+    parser.add_argument("--store", type=Path, default=None, help="Store folder, <dataset>_store by default")
+    parser.add_argument("--workers", type=int, default=None, help="Validation processes, one per CPU by default")
+    parser.add_argument("--prune", action="store_true", help="Delete the folders of countries that fail validation")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the dataset didn't change")
+    parser.add_argument("--strict", action="store_true", help="Exit with an error on warnings too")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    report = pipeline.build(args.dataset, args.store, workers=args.workers, prune=args.prune, force=args.force)
+    store_path = args.store or pipeline.default_store_path(args.dataset)
+    if report["skipped"]:
+        print(f"{args.dataset} didn't change since the last build, see {store_path / 'build_report.json'}")
+    else:
+        print(f"Built {store_path} from {report['countries']} countries in {time.perf_counter() - start_time:.2f}s")
+        print(", ".join(f"{name}: {seconds:.2f}s" for name, seconds in report["seconds"].items()))
+    print(f"History version: v{report['history_version']} in {history.default_history_path(store_path)}")
+    for country_code, problems in report["problems"].items():
+        for message in problems["errors"]:
+            print(f"ERROR {country_code}: {message}")
+        for message in problems["warnings"]:
+            print(f"WARNING {country_code}: {message}")
+    if report["excluded"]:
+        print(f"Left out (errors): {', '.join(report['excluded'])}" + (" (deleted)" if report["pruned"] else ""))
+    if (report["excluded"] and not report["pruned"]) or (args.strict and report["problems"]):
+        sys.exit(1)
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+# Chart payload preparation. Every st.vega_lite_chart call serializes its whole frame (index included) to Arrow
+# and ships it over the websocket, so frames are cut down to the fields the spec encodes, with the smallest
+# types that hold them, before they are drawn.
+
+
+def encoded_fields(spec):
+    # Every field a vega-lite spec refers to (encodings, sorts, facets), in order of appearance
+    fields = []
+    if isinstance(spec, dict):
+        for key, value in spec.items():
+            if key == "field" and isinstance(value, str):
+                fields.append(value)
+            else:
+                fields.extend(encoded_fields(value))
+    elif isinstance(spec, list):
+        for value in spec:
+            fields.extend(encoded_fields(value))
+    return list(dict.fromkeys(fields))
+
+
+def downcast(df, exact=()):
+    # float64 -> float32 (except the exact columns), integers to the smallest width holding them and repeated
+    # strings to categoricals, only the categories used are kept (a few countries' rows of the store don't ship
+    # every country's code)
+    columns = {}
+    for name, values in df.items():
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.cat.remove_unused_categories()
+        elif pd.api.types.is_float_dtype(values) and name in exact:
+            values = values.astype("float64")
+        elif pd.api.types.is_float_dtype(values):
+            values = values.astype("float32")
+        elif pd.api.types.is_integer_dtype(values):
+            values = pd.to_numeric(values, downcast="integer")
+        elif values.dtype == object:
+            values = values.astype("category")
+        columns[name] = values
+    return pd.DataFrame(columns).reset_index(drop=True)
+
+
+def widen(values):
+    # float64 of a float32 column with its shortest decimal text (617.3, not 617.2999877929688), which is the
+    # amount as parsed for the short amounts of the items and yearly tables. Columns the store keeps in float64
+    # (monthly amounts) are left as they are.
+    return values.astype(str).astype("float64") if values.dtype == "float32" else values
+
+
+def chart_frame(df, fields):
+    # Only the given fields of the frame, downcast and with a range index (which Arrow stores as metadata only)
+    return downcast(df[[field for field in fields if field in df.columns]])
+
+
+def downsample(df, series_field, value_field, max_points):
+    # Keep about max_points rows per series: each series longer than that is split into buckets of consecutive
+    # rows, and only the rows holding a bucket's lowest and highest value (plus the series ends) are kept,
+    # so peaks and dips survive. Rows must already be ordered inside each series.
+    if max_points is None or len(df) == 0:
+        return df
+    df = df.reset_index(drop=True)
+    groups = df.groupby(series_field, sort=False, observed=True)
+    position = groups.cumcount().to_numpy()
+    sizes = groups[value_field].transform("size").to_numpy()
+    num_buckets = max((max_points - 2) // 2, 1)
+    bucket_ids = pd.factorize(df[series_field])[0] * num_buckets + position * num_buckets // sizes
+    keep = (sizes <= max_points) | (position == 0) | (position == sizes - 1)
+    # Sorted by bucket then by value (ascending, then descending), the first row of every bucket is its lowest
+    # (highest) one, the earliest on ties
+    values = df[value_field].to_numpy()
+    for order in (np.lexsort((values, bucket_ids)), np.lexsort((-values, bucket_ids))):
+        sorted_ids = bucket_ids[order]
+        keep[order[np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]]] = True
+    return df[keep]
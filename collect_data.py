@@ -2,18 +2,31 @@ import warnings
 
 from tqdm import tqdm
 import requests
-from bs4 import BeautifulSoup
-from lxml import etree
 from pathlib import Path
 import json
+import os
+import argparse
+import hashlib
+import shutil
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 warnings.filterwarnings("ignore")
 
+import pipeline
+import snapshots
 import utils
 
 base_path = Path(__file__).parent
 dataset_path = (base_path / "dataset").resolve()
-dataset_path.mkdir(parents=True, exist_ok=True)
 
 country_codes = [
     "ETH",
@@ -231,35 +244,396 @@ country_codes = [
 ]
 base_url = "http://www.expoegypt.gov.eg/map/country-info?hscode=0&iso3={country_code}"
 
-for country_code in tqdm(country_codes):
-    # Create country folder
-    country_path = (dataset_path / country_code).resolve()
-    country_path.mkdir(parents=True, exist_ok=True)
+# One semaphore per host so concurrent workers don't flood a single server
+host_semaphores = {}
+host_semaphores_lock = threading.Lock()
 
-    # Get response and parse it
-    url = base_url.format(country_code=country_code)
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, "html.parser")
-    dom = etree.HTML(str(soup))
 
-    # Get country name
-    country_name = dom.xpath("//h3/span/span[@class='text-primary']/text()")[0]
+def make_session(pool_size=10, retries=3, backoff_factor=0.5):
+    # Keep-alive connections are pooled by the adapter and reused across countries
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
-    # Get total exports
-    total_export_text = dom.xpath("//div/span[@class='text-primary']/text()")[0]
-    total_export_amount, total_export_value = utils.parse_money(total_export_text)
 
-    # Write metadata to metadata.json
-    metadata = {"country_name": country_name, "total_export_amount": total_export_amount, "total_export_value": total_export_value}
-    with open(country_path / "metadata.json", "w") as f:
+def host_semaphore(url, max_per_host):
+    host = urlsplit(url).netloc
+    with host_semaphores_lock:
+        if host not in host_semaphores:
+            host_semaphores[host] = threading.BoundedSemaphore(max_per_host)
+        return host_semaphores[host]
+
+
+def load_manifest(manifest_file):
+    if not Path(manifest_file).exists():
+        return {}
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_file):
+    tmp_file = Path(manifest_file).with_suffix(".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    tmp_file.replace(manifest_file)
+
+
+class CrawlJournal:
+    # Append-only record of the countries the current crawl finished, one JSON line each, flushed to disk as
+    # they complete. If the crawl dies, the next run resumes from it instead of starting over, the journal is
+    # removed once a crawl went through every country.
+    def __init__(self, journal_file):
+        self.journal_file = Path(journal_file)
+        self.fp = None
+
+    def resume(self, url_template):
+        # Entries of an interrupted crawl of the same URL template by country code, or start a new journal
+        entries = {}
+        if self.journal_file.exists():
+            lines = self.journal_file.read_text().splitlines()
+            # A crash can leave a torn last line, the country it was recording is simply crawled again
+            records = []
+            for line in lines:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass
+            if len(records) > 0 and records[0].get("url_template") == url_template:
+                entries = {record["country_code"]: record for record in records[1:]}
+        if len(entries) == 0:
+            with open(self.journal_file, "w") as f:
+                f.write(json.dumps({"url_template": url_template, "started": time.time()}) + "\n")
+        self.fp = open(self.journal_file, "a")
+        return entries
+
+    def record(self, entry):
+        self.fp.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+
+    def close(self):
+        self.fp.close()
+        self.journal_file.unlink()
+
+
+def recover_staging(dataset_path):
+    # Undo what a crash in the middle of write_country left behind: a country moved aside but not replaced yet
+    # gets its previous folder back, unfinished new folders are dropped
+    staging_path = dataset_path / ".staging"
+    if not staging_path.exists():
+        return
+    for path in staging_path.glob("*.old"):
+        country_path = dataset_path / path.name.split(".")[0]
+        if not country_path.exists():
+            path.rename(country_path)
+    shutil.rmtree(staging_path)
+
+
+def write_country(dataset_path, country_code, page, metadata):
+    # Write the country's files to a staging folder and swap it in with renames, so the country's folder is
+    # always either its previous complete version or the new one
+    tmp_path = dataset_path / ".staging" / f"{country_code}.{uuid.uuid4().hex[:8]}"
+    tmp_path.mkdir(parents=True)
+    with open(tmp_path / "metadata.json", "w") as f:
         json.dump(metadata, f, indent=4, ensure_ascii=False)
+    utils.write_country_page(page, tmp_path)
+
+    country_path = dataset_path / country_code
+    old_path = tmp_path.with_name(tmp_path.name + ".old")
+    if country_path.exists():
+        country_path.rename(old_path)
+    tmp_path.rename(country_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def is_collected(country_path):
+    return all((country_path / name).exists() for name in ("items.csv", "yearly.csv", "monthly.csv"))
+
+
+def collect_country(session, country_code, dataset_path, url_template=base_url, max_per_host=4, timeout=60, manifest=None, skip_empty=False, snapshot_store=None):
+    timing = {"country_code": country_code, "status": None, "state": "changed", "bytes": 0, "fetch": 0.0, "parse": 0.0, "error": ""}
+    start_time = time.perf_counter()
+
+    # The country's folder only appears once all of its files are written
+    dataset_path = dataset_path.resolve()
+    country_path = dataset_path / country_code
+
+    # Ask the server to skip the body if the page didn't change since the last crawl
+    url = url_template.format(country_code=country_code)
+    entry = manifest.get(url) if manifest is not None and is_collected(country_path) else None
+    headers = {}
+    if entry is not None:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    # Get response and parse it
+    with host_semaphore(url, max_per_host):
+        response = session.get(url, headers=headers, timeout=timeout)
+    timing["status"] = response.status_code
+    timing["bytes"] = len(response.content)
+    timing["fetch"] = time.perf_counter() - start_time
+    timing["total"] = timing["fetch"]
+
+    if response.status_code == 304:
+        timing["state"] = "not-modified"
+        # The body stored by the crawl that fetched it is also this crawl's snapshot
+        if snapshot_store is not None and snapshot_store.has(entry.get("sha256") or ""):
+            snapshot_store.record(url, entry["sha256"], entry.get("encoding"), country_code)
+        return timing
+    response.raise_for_status()
+
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    if snapshot_store is not None:
+        snapshot_store.put(url, response.content, response.encoding, country_code)
+    new_entry = {
+        "country_code": country_code,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "sha256": content_hash,
+        # Kept for the snapshot of a later 304, which has no body to tell it
+        "encoding": response.encoding,
+    }
+    if entry is not None and entry.get("sha256") == content_hash:
+        # Same page under new validators, nothing to re-parse
+        timing["state"] = "unchanged"
+        manifest[url] = new_entry
+        return timing
+
+    parse_start = time.perf_counter()
+    page = utils.parse_country_page(response.content, encoding=response.encoding or "utf-8")
+
+    # Pages without any item (e.g. an HS chapter the country doesn't buy) can be left out of the dataset
+    if skip_empty and len(page["items"]["Item"]) == 0:
+        timing["state"] = "empty"
+        if manifest is not None:
+            manifest[url] = new_entry
+        timing["parse"] = time.perf_counter() - parse_start
+        timing["total"] = time.perf_counter() - start_time
+        return timing
+
+    # Get total exports
+    total_export_amount, total_export_value = utils.parse_money(page["total_export_text"])
 
+    metadata = {"country_name": page["country_name"], "total_export_amount": total_export_amount, "total_export_value": total_export_value}
     try:
-        utils.extract_items_data(dom, country_path / "items.csv")
-        utils.extract_yearly_data(dom, country_path / "yearly.csv")
-        utils.extract_monthly_yearly_data(dom, country_path / "monthly.csv")
+        write_country(dataset_path, country_code, page, metadata)
+        if manifest is not None:
+            manifest[url] = new_entry
     except Exception as e:
+        timing["error"] = str(e)
         print(f"Error in {country_code}: {e}")
         print(f"URL: {url}")
 
-utils.clean_dataset(dataset_path)
\ No newline at end of file
+    timing["parse"] = time.perf_counter() - parse_start
+    timing["total"] = time.perf_counter() - start_time
+    return timing
+
+
+def reparse_country(snapshots_root, entry, dataset_path):
+    # Same as collect_country from the stored body of the page, runs in a worker process
+    timing = {"country_code": entry["country_code"], "status": None, "state": "reparsed", "bytes": 0, "fetch": 0.0, "parse": 0.0, "error": ""}
+    start_time = time.perf_counter()
+    try:
+        content = snapshots.SnapshotStore(snapshots_root).get(entry["sha256"])
+        timing["bytes"] = len(content)
+        timing["fetch"] = time.perf_counter() - start_time
+        page = utils.parse_country_page(content, encoding=entry.get("encoding") or "utf-8")
+        total_export_amount, total_export_value = utils.parse_money(page["total_export_text"])
+        metadata = {"country_name": page["country_name"], "total_export_amount": total_export_amount, "total_export_value": total_export_value}
+        write_country(Path(dataset_path), entry["country_code"], page, metadata)
+    except Exception as e:
+        timing["state"] = "failed"
+        timing["error"] = str(e)
+    timing["total"] = time.perf_counter() - start_time
+    timing["parse"] = timing["total"] - timing["fetch"]
+    return timing
+
+
+def reparse(country_codes, dataset_path, snapshot_store, url_template=base_url, date=None, workers=None, manifest=None):
+    # Rebuild the countries' folders from their last snapshot on or before date without touching the network,
+    # parsing in parallel processes. Countries never snapshotted are reported as failed and left as they are.
+    entries = snapshot_store.latest(date)
+    timings = []
+    found = []
+    for country_code in country_codes:
+        entry = entries.get(url_template.format(country_code=country_code))
+        if entry is None:
+            timings.append({"country_code": country_code, "status": None, "state": "failed", "bytes": 0, "fetch": 0.0, "parse": 0.0, "total": 0.0, "error": "no snapshot"})
+        else:
+            found.append({**entry, "country_code": country_code})
+    workers = workers or os.cpu_count() or 1
+    dataset_path = Path(dataset_path).resolve()
+    if workers > 1 and len(found) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(found))) as executor:
+            futures = [executor.submit(reparse_country, snapshot_store.root, entry, dataset_path) for entry in found]
+            timings += [future.result() for future in tqdm(as_completed(futures), total=len(futures))]
+    else:
+        timings += [reparse_country(snapshot_store.root, entry, dataset_path) for entry in tqdm(found)]
+    # A country rebuilt from an older page than the manifest knows must not be answered with 304 by the next crawl
+    if manifest is not None:
+        for entry in found:
+            if manifest.get(entry["url"], {}).get("sha256") != entry["sha256"]:
+                manifest.pop(entry["url"], None)
+    return timings
+
+
+def collect(
+    country_codes,
+    dataset_path,
+    url_template=base_url,
+    workers=1,
+    max_per_host=4,
+    retries=3,
+    backoff_factor=0.5,
+    manifest=None,
+    journal=None,
+    snapshot_store=None,
+):
+    session = make_session(pool_size=max(workers, max_per_host), retries=retries, backoff_factor=backoff_factor)
+    timings = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                collect_country,
+                session,
+                country_code,
+                dataset_path,
+                url_template,
+                max_per_host,
+                manifest=manifest,
+                snapshot_store=snapshot_store,
+            ): country_code
+            for country_code in country_codes
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            country_code = futures[future]
+            try:
+                timing = future.result()
+                timings.append(timing)
+                if journal is not None and not timing["error"]:
+                    url = url_template.format(country_code=country_code)
+                    journal.record(
+                        {
+                            "country_code": country_code,
+                            "state": timing["state"],
+                            "url": url,
+                            "manifest": manifest.get(url) if manifest is not None else None,
+                        }
+                    )
+            except Exception as e:
+                # Keep the other countries going, the failure shows up in the report
+                print(f"Error in {country_code}: {e}")
+                timings.append({"country_code": country_code, "status": None, "state": "failed", "bytes": 0, "fetch": 0.0, "parse": 0.0, "total": 0.0, "error": str(e)})
+    session.close()
+    return timings
+
+
+def report_timings(timings, wall_time, output_file=None):
+    df_timings = pd.DataFrame(timings).set_index("country_code").sort_values("total", ascending=False)
+    failed = df_timings[df_timings["error"].astype(bool)]
+    print(f"Collected {len(df_timings) - len(failed)}/{len(df_timings)} countries in {wall_time:.1f}s")
+    print(f"Sum of per-country time: {df_timings['total'].sum():.1f}s")
+    print(f"Downloaded {df_timings['bytes'].sum() / 1e6:.2f} MB")
+    print(", ".join(f"{state}: {count}" for state, count in df_timings["state"].value_counts().items()))
+    print("Slowest countries:")
+    print(df_timings[["status", "state", "bytes", "fetch", "parse", "total"]].head(5).round(3).to_string())
+    if len(failed) > 0:
+        print(f"Failed countries: {', '.join(failed.index)}")
+    if output_file is not None:
+        df_timings.to_csv(output_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl Egypt's exports per country from EDA")
+    parser.add_argument("--dataset", type=Path, default=dataset_path, help="Output folder for the dataset")
+    parser.add_argument("--url", default=base_url, help="URL template with a {country_code} placeholder")
+    parser.add_argument("--countries", nargs="+", default=country_codes, help="ISO3 codes to crawl")
+    parser.add_argument("--workers", type=int, default=None, help="Number of countries fetched concurrently (1 by default) or re-parsed in parallel (one per CPU by default)")
+    parser.add_argument("--max-per-host", type=int, default=4, help="Max in-flight requests per host")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per request on errors")
+    parser.add_argument("--backoff", type=float, default=0.5, help="Backoff factor between retries in seconds")
+    parser.add_argument("--timings", type=Path, default=None, help="Write per-country timings to this CSV")
+    parser.add_argument("--full", action="store_true", help="Ignore the crawl manifest and re-download everything")
+    parser.add_argument("--restart", action="store_true", help="Start over instead of resuming an interrupted crawl")
+    parser.add_argument("--store", type=Path, default=None, help="Store folder built after the crawl, <dataset>_store by default")
+    parser.add_argument("--snapshots", type=Path, default=snapshots.snapshots_path, help="Folder keeping the raw pages of every crawl")
+    parser.add_argument("--no-snapshots", action="store_true", help="Don't keep the raw pages")
+    parser.add_argument("--reparse", nargs="?", const="latest", default=None, metavar="DATE", help="Rebuild the dataset from the pages snapshotted on or before DATE (YYYY-MM-DD, latest by default) without crawling")
+    args = parser.parse_args()
+
+    args.dataset.mkdir(parents=True, exist_ok=True)
+    snapshot_store = None if args.no_snapshots else snapshots.SnapshotStore(args.snapshots)
+    if args.reparse is not None:
+        if snapshot_store is None:
+            parser.error("--reparse reads the snapshots, it can't be used with --no-snapshots")
+        recover_staging(args.dataset)
+        manifest_file = args.dataset / "crawl_manifest.json"
+        manifest = load_manifest(manifest_file)
+        start_time = time.perf_counter()
+        timings = reparse(
+            args.countries,
+            args.dataset,
+            snapshot_store,
+            url_template=args.url,
+            date=None if args.reparse == "latest" else args.reparse,
+            workers=args.workers,
+            manifest=manifest,
+        )
+        save_manifest(manifest, manifest_file)
+        recover_staging(args.dataset)
+        report_timings(timings, time.perf_counter() - start_time, args.timings)
+        report = pipeline.build(args.dataset, args.store, prune=True)
+        print(f"Built the store from {report['countries']} countries, {len(report['problems'])} with problems (see build_report.json)")
+        sys.exit(0)
+
+    manifest_file = args.dataset / "crawl_manifest.json"
+    manifest = {} if args.full else load_manifest(manifest_file)
+    recover_staging(args.dataset)
+
+    # Countries an interrupted crawl already finished are not crawled again, not even by a full refresh
+    journal = CrawlJournal(args.dataset / "crawl_journal.jsonl")
+    if args.restart and journal.journal_file.exists():
+        journal.journal_file.unlink()
+    finished = journal.resume(args.url)
+    for entry in finished.values():
+        if entry["manifest"] is not None:
+            manifest[entry["url"]] = entry["manifest"]
+    country_codes_left = [country_code for country_code in args.countries if country_code not in finished]
+    if len(finished) > 0:
+        print(f"Resuming an interrupted crawl, {len(args.countries) - len(country_codes_left)} countries already done")
+
+    start_time = time.perf_counter()
+    timings = collect(
+        country_codes_left,
+        args.dataset,
+        url_template=args.url,
+        workers=args.workers or 1,
+        max_per_host=args.max_per_host,
+        retries=args.retries,
+        backoff_factor=args.backoff,
+        manifest=manifest,
+        journal=journal,
+        snapshot_store=snapshot_store,
+    )
+    save_manifest(manifest, manifest_file)
+    recover_staging(args.dataset)
+    # The crawl went through every country (failed ones are retried by the next crawl), nothing left to resume
+    journal.close()
+    if len(timings) > 0:
+        report_timings(timings, time.perf_counter() - start_time, args.timings)
+
+    # Validate what was crawled, drop the broken countries and rebuild the store
+    report = pipeline.build(args.dataset, args.store, prune=True)
+    print(f"Built the store from {report['countries']} countries, {len(report['problems'])} with problems (see build_report.json)")
+    if report["excluded"]:
+        print(f"Deleted countries that failed validation: {', '.join(report['excluded'])}")
@@ -0,0 +1,197 @@
+import argparse
+import itertools
+import queue
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+import requests
+from tqdm import tqdm
+
+import collect_data
+import pipeline
+import utils
+
+# Drill-down crawl of the per HS chapter pages (hscode=01..97) of every country. The (country, chapter) pairs are
+# expanded into a priority queue, biggest export destinations in metadata.json first, and fetched by a bounded
+# pool of workers that all draw from one token bucket, so the site sees at most --rate requests per second
+# whatever the concurrency. Every chapter is stored like dataset/: dataset_hs/<chapter>/<ISO3>/*.csv, and compiled
+# into dataset_hs_store/<chapter>/ by the build pipeline once crawled.
+
+base_path = Path(__file__).parent
+dataset_path = base_path / "dataset_hs"
+base_url = "http://www.expoegypt.gov.eg/map/country-info?hscode={hscode}&iso3={country_code}"
+
+
+class TokenBucket:
+    # rate tokens a second, at most capacity saved up for bursts. acquire() blocks until a token is available.
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def plan(country_codes, hscodes, metadata_file=None, top=None):
+    # (country, chapter) pairs in crawl order: countries by their total in metadata.json, biggest first (unknown
+    # countries last), every chapter of a country before the next one
+    ranks = {}
+    if metadata_file is not None and Path(metadata_file).exists():
+        df_countries = utils.normalize_money(
+            pd.read_json(metadata_file, orient="records"), "Export Amount", "Export Value"
+        )
+        ranked = df_countries.sort_values("Export Amount", ascending=False)["Country Code"]
+        ranks = {country_code: rank for rank, country_code in enumerate(ranked)}
+    country_codes = sorted(country_codes, key=lambda country_code: ranks.get(country_code, len(ranks)))
+    if top is not None:
+        country_codes = country_codes[:top]
+    return list(itertools.product(country_codes, hscodes))
+
+
+def crawl(
+    work,
+    dataset_path,
+    url_template=base_url,
+    rate=5.0,
+    burst=5,
+    workers=8,
+    max_per_host=4,
+    retries=3,
+    backoff_factor=0.5,
+    requeues=1,
+    manifest=None,
+    manifest_file=None,
+):
+    # Fetch the (country, chapter) pairs of work in order with workers threads sharing one rate limit. A pair that
+    # fails on the network goes back to the end of the queue up to requeues times, pages that don't exist don't.
+    dataset_path = Path(dataset_path)
+    work_queue = queue.PriorityQueue()
+    for priority, (country_code, hscode) in enumerate(work):
+        work_queue.put((priority, 0, country_code, hscode))
+    bucket = TokenBucket(rate, burst)
+    session = collect_data.make_session(
+        pool_size=max(workers, max_per_host), retries=retries, backoff_factor=backoff_factor
+    )
+    timings = []
+    timings_lock = threading.Lock()
+    progress = tqdm(total=len(work))
+
+    def worker():
+        while True:
+            try:
+                priority, attempt, country_code, hscode = work_queue.get_nowait()
+            except queue.Empty:
+                return
+            bucket.acquire()
+            try:
+                timing = collect_data.collect_country(
+                    session,
+                    country_code,
+                    dataset_path / hscode,
+                    url_template.replace("{hscode}", hscode),
+                    max_per_host,
+                    manifest=manifest,
+                    skip_empty=True,
+                )
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.RetryError) as e:
+                if attempt < requeues:
+                    work_queue.put((priority + len(work), attempt + 1, country_code, hscode))
+                    continue
+                timing = {"country_code": country_code, "status": None, "state": "failed", "error": str(e)}
+            except Exception as e:
+                timing = {"country_code": country_code, "status": None, "state": "failed", "error": str(e)}
+            timing["hscode"] = hscode
+            with timings_lock:
+                timings.append(timing)
+                progress.update()
+                # Keep the validators of what was fetched so far in case the crawl is stopped
+                if manifest_file is not None and len(timings) % 100 == 0:
+                    collect_data.save_manifest(dict(manifest), manifest_file)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    progress.close()
+    session.close()
+    return timings
+
+
+def build_chapters(dataset_path, store_path, hscodes):
+    # Validate and compile the given chapters with the build pipeline, each one like dataset/ into dataset_store/
+    reports = {}
+    for hscode in hscodes:
+        if (Path(dataset_path) / hscode).is_dir():
+            reports[hscode] = pipeline.build(Path(dataset_path) / hscode, Path(store_path) / hscode, prune=True)
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl Egypt's exports per country and HS chapter from EDA")
+    parser.add_argument("--dataset", type=Path, default=dataset_path, help="Output folder, one dataset per chapter")
+    parser.add_argument("--store", type=Path, default=None, help="Stores of the chapters, <dataset>_store by default")
+    parser.add_argument("--url", default=base_url, help="URL template with {hscode} and {country_code} placeholders")
+    parser.add_argument("--metadata", type=Path, default=base_path / "dataset" / "metadata.json")
+    parser.add_argument("--countries", nargs="+", default=collect_data.country_codes, help="ISO3 codes to crawl")
+    parser.add_argument("--top", type=int, default=None, help="Only the top N export destinations")
+    parser.add_argument("--hscodes", nargs="+", default=utils.hs_chapters, help="Two-digit HS chapters to crawl")
+    parser.add_argument("--rate", type=float, default=5.0, help="Max requests per second")
+    parser.add_argument("--burst", type=int, default=5, help="Requests that can be sent at once after a pause")
+    parser.add_argument("--workers", type=int, default=8, help="Max requests in flight")
+    parser.add_argument("--max-per-host", type=int, default=4, help="Max in-flight requests per host")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per request on errors")
+    parser.add_argument("--timings", type=Path, default=None, help="Write per-page timings to this CSV")
+    parser.add_argument("--full", action="store_true", help="Ignore the crawl manifest and re-download everything")
+    parser.add_argument("--no-build", action="store_true", help="Don't validate and compile the crawled chapters")
+    args = parser.parse_args()
+
+    args.dataset.mkdir(parents=True, exist_ok=True)
+    manifest_file = args.dataset / "crawl_manifest.json"
+    manifest = {} if args.full else collect_data.load_manifest(manifest_file)
+    for hscode in args.hscodes:
+        collect_data.recover_staging(args.dataset / hscode)
+
+    work = plan(args.countries, args.hscodes, args.metadata, args.top)
+    print(f"Crawling {len(work)} pages at up to {args.rate:g} requests per second with {args.workers} workers")
+    start_time = time.perf_counter()
+    timings = crawl(
+        work,
+        args.dataset,
+        url_template=args.url,
+        rate=args.rate,
+        burst=args.burst,
+        workers=args.workers,
+        max_per_host=args.max_per_host,
+        retries=args.retries,
+        manifest=manifest,
+        manifest_file=manifest_file,
+    )
+    wall_time = time.perf_counter() - start_time
+    collect_data.save_manifest(manifest, manifest_file)
+
+    df_timings = pd.DataFrame(timings)
+    print(f"{len(df_timings)} pages in {wall_time:.1f}s ({len(df_timings) / wall_time:.1f} pages/s)")
+    print(", ".join(f"{state}: {count}" for state, count in df_timings["state"].value_counts().items()))
+    if args.timings is not None:
+        df_timings.to_csv(args.timings, index=False)
+
+    if not args.no_build:
+        changed = sorted(df_timings.loc[df_timings["state"] == "changed", "hscode"].unique())
+        store_path = args.store or pipeline.default_store_path(args.dataset)
+        reports = build_chapters(args.dataset, store_path, changed)
+        print(f"Built {len(reports)} chapter stores in {store_path}")
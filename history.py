@@ -0,0 +1,250 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import pandas as pd
+
+import charts
+import search
+import utils
+
+# Every build of the store as a version, stored as the rows that changed since the previous one. A version is a
+# folder of zstd-compressed Arrow files per table: upserts (rows added or with new values) and removed (keys
+# only), plus a full copy of the tables every checkpoint_every versions so loading a version never replays more
+# than that many deltas. versions.json lists the versions with what changed in each. Rows are identified by
+# their key columns, items by name and occurrence since a country can list the same name twice.
+
+# Key and value columns of the tables kept, the rest of the store is derived from them
+history_tables = {
+    "countries": (["Country Code"], ["Country Name", "Export Amount", "Color"]),
+    "items": (["Country Code", "Item", "Occurrence"], ["Amount"]),
+    "yearly": (["Country Code", "Year"], ["Export Amount"]),
+    "monthly": (["Country Code", "Year", "Month"], ["Export Amount"]),
+}
+checkpoint_every = 10
+
+
+def default_history_path(store_path):
+    return Path(store_path) / "history"
+
+
+def history_frames(tables):
+    # Key and value columns of the store tables, strings as objects and items numbered per (country, name) in
+    # store order
+    frames = {
+        name: df.astype({column: object for column, values in df.items() if values.dtype == "category"})
+        for name, df in tables.items()
+    }
+    items = frames["items"]
+    frames["items"] = items.assign(
+        Occurrence=items.groupby(["Country Code", "Item"], dropna=False, sort=False).cumcount()
+    )
+    return {name: frames[name][keys + values].reset_index(drop=True) for name, (keys, values) in history_tables.items()}
+
+
+def row_keys(df, keys):
+    # One string per row joining its key columns, so frames can be matched with a flat index. Missing keys (items
+    # without a name) are read back from Arrow as None but come out of the build as NaN, both are ""
+    columns = [df[key].where(df[key].notna(), "").astype(str) for key in keys]
+    return pd.Index(columns[0].str.cat(columns[1:], sep="\x1f") if len(columns) > 1 else columns[0])
+
+
+def compare(old_df, new_df, name):
+    # Rows added, removed and changed between two frames of a table: key columns, "<value> old" and
+    # "<value> new" columns (NaN where the row doesn't exist) and a Change column
+    keys, values = history_tables[name]
+    old_df = old_df.set_axis(row_keys(old_df, keys))
+    new_df = new_df.set_axis(row_keys(new_df, keys))
+    common = new_df.index.intersection(old_df.index)
+    old_common, new_common = old_df.loc[common, values], new_df.loc[common, values]
+    # Amounts the store keeps in float32 are compared at that precision with versions recorded in float64
+    for value in values:
+        if "float32" in (old_common[value].dtype, new_common[value].dtype):
+            old_common[value] = old_common[value].astype("float32")
+            new_common[value] = new_common[value].astype("float32")
+    differs = (old_common != new_common) & ~(old_common.isna() & new_common.isna())
+    changed = common[differs.any(axis=1).to_numpy()]
+    added = new_df.index.difference(old_df.index, sort=False)
+    removed = old_df.index.difference(new_df.index, sort=False)
+
+    def side(df, index, suffix):
+        return df.loc[index, values].rename(columns=lambda column: f"{column} {suffix}")
+
+    parts = [
+        pd.concat([new_df.loc[added, keys], side(new_df, added, "new")], axis=1).assign(Change="added"),
+        pd.concat([old_df.loc[removed, keys], side(old_df, removed, "old")], axis=1).assign(Change="removed"),
+        pd.concat(
+            [new_df.loc[changed, keys], side(old_df, changed, "old"), side(new_df, changed, "new")], axis=1
+        ).assign(Change="changed"),
+    ]
+    columns = keys + [f"{value} {suffix}" for value in values for suffix in ("old", "new")] + ["Change"]
+    return pd.concat(parts, ignore_index=True).reindex(columns=columns)
+
+
+def apply_delta(df, name, upserts, removed):
+    # Previous rows of a table with the removed keys dropped, upserted rows replaced in place and new ones appended
+    keys, values = history_tables[name]
+    df = df.set_axis(row_keys(df, keys))
+    df = df[~df.index.isin(row_keys(removed, keys))].copy()
+    upserts = upserts.set_axis(row_keys(upserts, keys))
+    existing = upserts.index.isin(df.index)
+    if existing.any():
+        df.loc[upserts.index[existing], values] = upserts.loc[existing, values]
+    if not existing.all():
+        df = pd.concat([df, upserts[~existing]])
+    return df.reset_index(drop=True)
+
+
+def in_store_order(frames):
+    # Tables sorted as build_store writes them: countries in their order, items biggest first, years and months in
+    # order (a stable sort keeps the recorded order of ties)
+    codes = frames["countries"]["Country Code"].tolist()
+    positions = {
+        "items": (["Amount"], [False]),
+        "yearly": (["Year"], [True]),
+        "monthly": (["Year", "Month Number"], [True, True]),
+    }
+    frames = {**frames, "monthly": utils.add_month_periods(frames["monthly"])}
+    for name, (columns, ascending) in positions.items():
+        df = frames[name].assign(Position=pd.Categorical(frames[name]["Country Code"], categories=codes).codes)
+        df = df[df["Position"] >= 0].sort_values(["Position"] + columns, ascending=[True] + ascending, kind="mergesort")
+        frames[name] = df.drop(columns="Position").reset_index(drop=True)
+    return frames
+
+
+class History:
+    # Versions of one store, materialized versions are kept in a small cache since diffs and the app reuse them
+    def __init__(self, history_path, max_cached=4):
+        self.history_path = Path(history_path)
+        self.max_cached = max_cached
+        self.cache = OrderedDict()
+        self.lock = threading.RLock()
+
+    def versions(self):
+        log_file = self.history_path / "versions.json"
+        return json.loads(log_file.read_text()) if log_file.exists() else []
+
+    def latest(self):
+        versions = self.versions()
+        return versions[-1]["version"] if versions else None
+
+    def version_path(self, version):
+        return self.history_path / f"v{version:05d}"
+
+    def read_frame(self, version, kind, name):
+        path = self.version_path(version) / f"{kind}_{name}.arrow"
+        if not path.exists():
+            keys, values = history_tables[name]
+            return pd.DataFrame(columns=keys if kind == "removed" else keys + values)
+        return pd.read_feather(path)
+
+    def frames(self, version):
+        # Key and value columns of every table as of version, from the last checkpoint and the deltas after it
+        with self.lock:
+            if version in self.cache:
+                self.cache.move_to_end(version)
+                return self.cache[version]
+            entries = {entry["version"]: entry for entry in self.versions()}
+            if version not in entries:
+                raise KeyError(f"No version {version} in {self.history_path}")
+            checkpoint = max(number for number, entry in entries.items() if entry["checkpoint"] and number <= version)
+            frames = {name: self.read_frame(checkpoint, "full", name) for name in history_tables}
+            for number in range(checkpoint + 1, version + 1):
+                for name in history_tables:
+                    upserts = self.read_frame(number, "upserts", name)
+                    removed = self.read_frame(number, "removed", name)
+                    if len(upserts) or len(removed):
+                        frames[name] = apply_delta(frames[name], name, upserts, removed)
+            self.cache[version] = frames
+            if len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+            return frames
+
+    def load(self, version, tables=utils.store_tables):
+        # Store tables as they were in version, shaped like utils.load_store's
+        frames = in_store_order(self.frames(version))
+        frames["items"] = frames["items"].drop(columns="Occurrence")
+        frames["monthly"] = frames["monthly"][
+            ["Country Code", "Year", "Month", "Month Number", "Date", "Period", "Export Amount"]
+        ]
+        if "products" in tables:
+            frames["products"] = search.build_products_table(frames["items"])
+        return {name: charts.downcast(frames[name], utils.exact_columns.get(name, ())) for name in tables}
+
+    def diff(self, old_version, new_version, tables=tuple(history_tables), country_codes=None):
+        # Rows that differ between two versions per table, optionally only for some countries
+        old_frames, new_frames = self.frames(old_version), self.frames(new_version)
+        diffs = {}
+        for name in tables:
+            old_df, new_df = old_frames[name], new_frames[name]
+            if country_codes is not None:
+                old_df = old_df[old_df["Country Code"].isin(country_codes)]
+                new_df = new_df[new_df["Country Code"].isin(country_codes)]
+            diffs[name] = compare(old_df, new_df, name)
+        return diffs
+
+    def record(self, tables, dataset_version=None):
+        # Add the store tables as a new version if anything changed since the latest one, returns its number
+        with self.lock:
+            frames = history_frames(tables)
+            versions = self.versions()
+            previous = versions[-1]["version"] if versions else None
+            diffs = {}
+            if previous is not None:
+                previous_frames = self.frames(previous)
+                diffs = {name: compare(previous_frames[name], frames[name], name) for name in history_tables}
+                if all(len(df) == 0 for df in diffs.values()):
+                    return previous
+
+            version = (previous or 0) + 1
+            checkpoint = previous is None or version % checkpoint_every == 0
+            tmp_path = self.version_path(version).with_suffix(".tmp")
+            tmp_path.mkdir(parents=True, exist_ok=True)
+            counts = {}
+            for name, (keys, values) in history_tables.items():
+                if checkpoint:
+                    frames[name].to_feather(tmp_path / f"full_{name}.arrow", compression="zstd")
+                if previous is None:
+                    counts[name] = {"added": len(frames[name]), "removed": 0, "changed": 0}
+                    continue
+                df = diffs[name]
+                counts[name] = {
+                    change: int((df["Change"] == change).sum()) for change in ("added", "removed", "changed")
+                }
+                upserts = df[df["Change"] != "removed"]
+                removed = df[df["Change"] == "removed"]
+                if len(upserts):
+                    upserts[keys].assign(**{value: upserts[f"{value} new"] for value in values}).reset_index(
+                        drop=True
+                    ).to_feather(tmp_path / f"upserts_{name}.arrow", compression="zstd")
+                if len(removed):
+                    removed[keys].reset_index(drop=True).to_feather(
+                        tmp_path / f"removed_{name}.arrow", compression="zstd"
+                    )
+            tmp_path.replace(self.version_path(version))
+
+            versions.append(
+                {
+                    "version": version,
+                    "time": time.time(),
+                    "dataset_version": dataset_version,
+                    "checkpoint": checkpoint,
+                    "bytes": sum(path.stat().st_size for path in self.version_path(version).iterdir()),
+                    "changes": counts,
+                }
+            )
+            tmp_file = self.history_path / "versions.json.tmp"
+            tmp_file.write_text(json.dumps(versions, indent=4))
+            tmp_file.replace(self.history_path / "versions.json")
+            self.cache[version] = frames
+            return version
+
+
+def version_label(entry):
+    # "v3 2023-02-25 14:02 (+12 -3 ~40)" for selectors and listings
+    changes = entry["changes"].values()
+    added, removed, changed = (sum(change[kind] for change in changes) for kind in ("added", "removed", "changed"))
+    date = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["time"]))
+    return f"v{entry['version']} {date} (+{added} -{removed} ~{changed})"
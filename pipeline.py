@@ -0,0 +1,345 @@
+import colorsys
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import history
+import utils
+
+# Dataset build pipeline, run after every crawl: each country folder is validated and normalized in a process pool
+# (schema, numeric parsing, year and month coverage, monthly sums against the yearly totals), then metadata.json
+# is assembled from the country folders, the store is rebuilt from the already normalized tables of the valid ones
+# and a build_report.json with the problems found is written next to the store. Nothing is rewritten when nothing
+# changed, so running it twice in a row is cheap and leaves the dataset signature (and the app's caches) alone.
+
+required_columns = {
+    "items.csv": ["Item", "Amount", "Value"],
+    "yearly.csv": ["Year", "Export Amount", "Export Value"],
+    "monthly.csv": ["Year", "Month", "Export Amount"],
+}
+# Monthly sums match the rounded yearly totals up to that rounding, anything beyond this share of the total is flagged
+sum_tolerance = 0.01
+
+
+def rounding_slack(amounts, multipliers):
+    # Half a unit of the last decimal each amount was written with, in million dollars (e.g. "2.0" billion: 50)
+    decimals = amounts.str.split(".").str[1].str.len().fillna(0).to_numpy(dtype="float64")
+    return 0.5 * 10**-decimals * multipliers / 1e6
+
+
+def flag(problems, codes, message):
+    for code in pd.unique(codes):
+        problems.setdefault(code, []).append(message(code) if callable(message) else message)
+
+
+def check_tables(items_df, yearly_df, monthly_df):
+    # Validate the tables of several countries at once (tagged with their Country Code). Returns errors and
+    # warnings by country, errors keep a country out of the build.
+    errors, warnings = {}, {}
+    monthly_amounts = pd.to_numeric(monthly_df["Export Amount"].astype(str).str.replace(",", ""), errors="coerce")
+    for name, df, column, values in [
+        ("items.csv", items_df, "Amount", pd.to_numeric(items_df["Amount"], errors="coerce")),
+        ("yearly.csv", yearly_df, "Export Amount", pd.to_numeric(yearly_df["Export Amount"], errors="coerce")),
+        ("monthly.csv", monthly_df, "Export Amount", monthly_amounts),
+    ]:
+        bad_df = df[values.isna() & df[column].notna()]
+        flag(
+            errors,
+            bad_df["Country Code"],
+            lambda code: f"{name} has non-numeric {column} {bad_df.loc[bad_df['Country Code'] == code, column].tolist()[:3]}",
+        )
+    for name, df in [("yearly.csv", yearly_df), ("monthly.csv", monthly_df)]:
+        years = pd.to_numeric(df["Year"], errors="coerce")
+        flag(errors, df.loc[years.isna() | (years % 1 != 0), "Country Code"], f"{name} has invalid years")
+    unknown_df = monthly_df[~monthly_df["Month"].isin(utils.arabic_months.keys())]
+    flag(
+        errors,
+        unknown_df["Country Code"],
+        lambda code: f"monthly.csv has unknown months {sorted(set(unknown_df.loc[unknown_df['Country Code'] == code, 'Month'].astype(str)))}",
+    )
+
+    # The rest only makes sense on parsed values, so it looks at the countries without errors
+    items_df, yearly_df, monthly_df = (
+        df[~df["Country Code"].isin(errors.keys())] for df in (items_df, yearly_df, monthly_df)
+    )
+    monthly_amounts = monthly_amounts[monthly_df.index]
+    yearly_amounts = pd.to_numeric(yearly_df["Export Amount"])
+    yearly_df = yearly_df.assign(Year=yearly_df["Year"].astype("int64"))
+    monthly_df = monthly_df.assign(Year=monthly_df["Year"].astype("int64"))
+
+    # Units are only needed where there is an amount, yearly rows without exports have none
+    for name, df, values, value_column in [
+        ("items.csv", items_df, pd.to_numeric(items_df["Amount"]), "Value"),
+        ("yearly.csv", yearly_df, yearly_amounts, "Export Value"),
+    ]:
+        unknown = np.isnan(utils.money_multipliers(df[value_column])) & (values.fillna(0) != 0).to_numpy()
+        flag(warnings, df.loc[unknown, "Country Code"], f"{name} has amounts in unknown units")
+
+    yearly_groups = yearly_df.groupby("Country Code", sort=False)["Year"]
+    coverage = pd.DataFrame(
+        {
+            "rows": yearly_groups.size(),
+            "years": yearly_groups.nunique(),
+            "span": yearly_groups.max() - yearly_groups.min() + 1,
+        }
+    )
+    flag(
+        warnings,
+        coverage.index[(coverage["rows"] != coverage["years"]) | (coverage["years"] != coverage["span"])],
+        "yearly.csv is not one row per year over a continuous range",
+    )
+    yearly_keys = pd.MultiIndex.from_frame(yearly_df[["Country Code", "Year"]]).unique()
+    monthly_keys = pd.MultiIndex.from_frame(monthly_df[["Country Code", "Year"]]).unique()
+    flag(
+        warnings,
+        yearly_keys.symmetric_difference(monthly_keys).get_level_values(0),
+        "monthly.csv and yearly.csv cover different years",
+    )
+    months_per_year = monthly_df.groupby(["Country Code", "Year"], sort=False)["Month"].nunique()
+    short_years = months_per_year[months_per_year < 12]
+    flag(
+        warnings,
+        short_years.index.get_level_values(0),
+        lambda code: f"monthly.csv has less than 12 months in {short_years[code].index.tolist()}",
+    )
+
+    # Yearly totals are rounded to a couple of digits, so only differences beyond that rounding count
+    multipliers = np.nan_to_num(utils.money_multipliers(yearly_df["Export Value"]), nan=1e6)
+    sums = (
+        pd.DataFrame(
+            {
+                "Country Code": yearly_df["Country Code"],
+                "Year": yearly_df["Year"],
+                "Yearly": yearly_amounts.to_numpy() * multipliers / 1e6,
+                "Slack": rounding_slack(yearly_df["Export Amount"].astype(str), multipliers),
+            }
+        )
+        .groupby(["Country Code", "Year"], sort=False)
+        .sum()
+    )
+    sums["Monthly"] = (monthly_amounts / 1e6).groupby([monthly_df["Country Code"], monthly_df["Year"]]).sum()
+    off = sums[
+        sums["Monthly"].notna()
+        & ((sums["Monthly"] - sums["Yearly"]).abs() > sums["Slack"] + sum_tolerance * sums["Yearly"])
+    ]
+    flag(
+        warnings,
+        off.index.get_level_values(0),
+        lambda code: "monthly sums differ from the yearly total in "
+        + ", ".join(
+            f"{year} ({row.Monthly:.4g} vs {row.Yearly:.4g} million)" for year, row in off.loc[code].iterrows()
+        ),
+    )
+    return errors, warnings
+
+
+def check_countries(country_paths):
+    # Validate a batch of country folders and normalize the tables of the valid ones, run in the worker processes.
+    # Batches are checked as one set of tables, which is much cheaper than one small frame per country.
+    results, frames = {}, {}
+    for country_path in map(Path, country_paths):
+        result = results[country_path.name] = {"errors": [], "warnings": [], "metadata": None}
+        if (country_path / "metadata.json").exists():
+            result["metadata"] = json.loads((country_path / "metadata.json").read_text())
+        missing = [name for name in required_columns if not (country_path / name).exists()]
+        if missing:
+            result["errors"].append(f"missing {', '.join(missing)}")
+            continue
+        try:
+            country_frames = utils.read_country_csvs(country_path)
+        except (ValueError, pd.errors.ParserError) as error:
+            result["errors"].append(f"unreadable CSV: {error}")
+            continue
+        for name, df in zip(required_columns, country_frames):
+            missing = [column for column in required_columns[name] if column not in df.columns]
+            if missing:
+                result["errors"].append(f"{name} is missing columns {missing}")
+        if not result["errors"]:
+            frames[country_path.name] = [
+                df[required_columns[name]].assign(**{"Country Code": country_path.name})
+                for name, df in zip(required_columns, country_frames)
+            ]
+    if not frames:
+        return results, None
+
+    tables = [
+        pd.concat([country_frames[idx] for country_frames in frames.values()], ignore_index=True) for idx in range(3)
+    ]
+    errors, warnings = check_tables(*tables)
+    for code, messages in errors.items():
+        results[code]["errors"] += messages
+    for code, messages in warnings.items():
+        results[code]["warnings"] += messages
+    if errors:
+        tables = [df[~df["Country Code"].isin(errors.keys())] for df in tables]
+    return results, utils.normalize_tables(*tables)
+
+
+def country_color(country_code):
+    # Stable color for countries without one: hue from a hash of the code, same lightness as the existing ones
+    digest = hashlib.sha1(country_code.encode()).digest()
+    red, green, blue = colorsys.hls_to_rgb(digest[0] / 256, 0.5, 0.55)
+    return "#{:02X}{:02X}{:02X}".format(round(red * 255), round(green * 255), round(blue * 255))
+
+
+def assemble_metadata(results, previous_df, pruned=()):
+    # One row per country folder, totals from the crawled metadata.json of the country when there is one and from
+    # the previous metadata.json otherwise. Known countries keep their place and color, new ones are appended.
+    # Countries with errors keep their row (they are only left out of the store) unless their folder was pruned,
+    # so they come back once their files are fixed.
+    previous = {row["Country Code"]: row for row in previous_df.to_dict("records")}
+    rows = {}
+    for code, result in results.items():
+        metadata = result["metadata"]
+        if code in pruned:
+            continue
+        if metadata is not None:
+            row = {
+                "Country Name": metadata["country_name"],
+                "Country Code": code,
+                "Export Amount": metadata["total_export_amount"],
+                "Export Value": metadata["total_export_value"],
+                "Color": previous.get(code, {}).get("Color") or country_color(code),
+            }
+        elif code in previous:
+            row = previous[code]
+        else:
+            result["warnings"].append("no metadata.json, left out of the dataset metadata")
+            continue
+        rows[code] = row
+    order = [code for code in previous if code in rows] + sorted(code for code in rows if code not in previous)
+    return pd.DataFrame(
+        [rows[code] for code in order],
+        columns=["Country Name", "Country Code", "Export Amount", "Export Value", "Color"],
+    )
+
+
+def write_if_changed(path, text):
+    # Leave the file (and its mtime) alone when the content is the same
+    if path.exists() and path.read_text(encoding="utf-8") == text:
+        return False
+    tmp_file = path.with_name(path.name + ".tmp")
+    tmp_file.write_text(text, encoding="utf-8")
+    tmp_file.replace(path)
+    return True
+
+
+def default_store_path(dataset_path):
+    dataset_path = Path(dataset_path)
+    return dataset_path.with_name(f"{dataset_path.name}_store")
+
+
+def build(dataset_path, store_path=None, workers=None, prune=False, force=False):
+    # Validate, assemble and compile dataset_path, returns the build report. Countries with errors are left out
+    # of the store, and their folders and metadata.json rows deleted with prune. Without force, a dataset unchanged
+    # since the last build only returns the previous report.
+    dataset_path = Path(dataset_path)
+    store_path = Path(store_path) if store_path is not None else default_store_path(dataset_path)
+    report_file = store_path / "build_report.json"
+    version_file = store_path / "version.json"
+    if not force and report_file.exists() and version_file.exists():
+        report = json.loads(report_file.read_text())
+        if report["version"] == json.loads(version_file.read_text()) == utils.store_version(dataset_path):
+            report["skipped"] = True
+            return report
+
+    timings = {}
+    start_time = time.perf_counter()
+    # Hidden folders are the crawler's staging area, not countries
+    country_paths = sorted(
+        entry.path for entry in os.scandir(dataset_path) if entry.is_dir() and not entry.name.startswith(".")
+    )
+    workers = workers or os.cpu_count()
+    # A couple of batches per worker keeps them all busy without paying the per-batch overhead too often
+    num_batches = 1 if workers == 1 else min(2 * workers, len(country_paths))
+    batches = [country_paths[idx::num_batches] for idx in range(num_batches)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            batch_results = list(executor.map(check_countries, batches))
+    else:
+        batch_results = [check_countries(batch) for batch in batches]
+    results = {code: batch[0][code] for batch in batch_results for code in batch[0]}
+    results = {code: results[code] for code in sorted(results)}
+    normalized = [batch[1] for batch in batch_results if batch[1] is not None]
+    normalized_tables = (
+        [pd.concat([tables[idx] for tables in normalized], ignore_index=True) for idx in range(3)]
+        if normalized
+        else None
+    )
+    timings["validate"] = time.perf_counter() - start_time
+
+    # Countries should all cover the same years, flag the ones that don't
+    if normalized_tables is not None:
+        country_years = (
+            normalized_tables[1].groupby("Country Code")["Year"].agg(lambda years: tuple(sorted(years.unique())))
+        )
+        common_years = country_years.mode()[0]
+        for code, years in country_years[country_years != common_years].items():
+            missing, extra = sorted(set(common_years) - set(years)), sorted(set(years) - set(common_years))
+            results[code]["warnings"].append(f"years differ from most countries, missing {missing} and extra {extra}")
+
+    start_time = time.perf_counter()
+    excluded = [code for code, result in results.items() if result["errors"]]
+    if prune:
+        for country_code in excluded:
+            for file in (dataset_path / country_code).iterdir():
+                file.unlink()
+            (dataset_path / country_code).rmdir()
+    metadata_file = dataset_path / "metadata.json"
+    previous_df = (
+        pd.read_json(metadata_file, orient="records")
+        if metadata_file.exists()
+        else pd.DataFrame(columns=["Country Code"])
+    )
+    df_metadata = assemble_metadata(results, previous_df, excluded if prune else ())
+    dropped = sorted(set(previous_df["Country Code"]) - set(df_metadata["Country Code"]))
+    metadata_changed = write_if_changed(
+        metadata_file, df_metadata.to_json(orient="records", indent=4, force_ascii=False)
+    )
+    timings["metadata"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    version = utils.store_version(dataset_path)
+    store_built = force or not version_file.exists() or json.loads(version_file.read_text()) != version
+    store_tables = utils.build_store(dataset_path, store_path, normalized_tables, excluded) if store_built else None
+    timings["store"] = time.perf_counter() - start_time
+
+    # Every store built is a version in the history, as the rows that changed since the previous one. The app and
+    # the API rebuild a stale store on their own, so whether this dataset is recorded is told by the history itself
+    start_time = time.perf_counter()
+    dataset_history = history.History(history.default_history_path(store_path))
+    versions = dataset_history.versions()
+    if not versions or versions[-1]["dataset_version"] != version:
+        store_tables = store_tables or utils.load_store(dataset_path, store_path)
+        history_version = dataset_history.record(store_tables, version)
+    else:
+        history_version = dataset_history.latest()
+    timings["history"] = time.perf_counter() - start_time
+
+    report = {
+        "version": version,
+        "skipped": False,
+        "workers": workers,
+        "countries": int((~df_metadata["Country Code"].isin(excluded)).sum()),
+        "excluded": excluded,
+        "pruned": prune,
+        "dropped_from_metadata": dropped,
+        "metadata_changed": metadata_changed,
+        "store_built": store_built,
+        "history_version": history_version,
+        "seconds": {name: round(seconds, 3) for name, seconds in timings.items()},
+        "problems": {
+            code: {"errors": result["errors"], "warnings": result["warnings"]}
+            for code, result in results.items()
+            if result["errors"] or result["warnings"]
+        },
+    }
+    store_path.mkdir(parents=True, exist_ok=True)
+    write_if_changed(report_file, json.dumps(report, indent=4, ensure_ascii=False))
+    return report
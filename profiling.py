@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+# Opt-in instrumentation of app.py reruns. With EXPORTS_PROFILE=1 in the environment (every rerun) or ?profile=1 in
+# the app URL (that session only), each rerun times its phases and chapters and counts what the process read
+# meanwhile. Every rerun is appended as one JSON line to <EXPORTS_PROFILE_DIR>/reruns.jsonl and added to the
+# Prometheus-style totals in metrics.prom (also served on EXPORTS_PROFILE_PORT when set).
+# EXPORTS_PROFILE_CPROFILE=1 also dumps a cProfile file per rerun. Disabled, phase() only returns a shared no-op
+# context, so the instrumentation stays in place at the cost of a function call.
+
+enabled = os.environ.get("EXPORTS_PROFILE", "0") not in ("", "0")
+output_dir = Path(os.environ.get("EXPORTS_PROFILE_DIR", Path(__file__).parent / "profiles"))
+dump_cprofile = os.environ.get("EXPORTS_PROFILE_CPROFILE", "0") not in ("", "0")
+metrics_port = int(os.environ.get("EXPORTS_PROFILE_PORT", "0"))
+
+logger = logging.getLogger("exports.profile")
+noop = nullcontext()
+# Streamlit runs every session's script in its own thread, so the rerun being recorded is kept per thread
+current = threading.local()
+lock = threading.Lock()
+totals = {}
+reruns = 0
+metrics_server = None
+own_reads, own_bytes = 0, 0
+
+
+def read_counters():
+    # Read calls and bytes read by the whole process so far, from /proc (zeros where it doesn't exist), minus the
+    # reads of /proc itself. Memory-mapped store files are not counted, only read calls are.
+    global own_reads, own_bytes
+    try:
+        fd = os.open("/proc/self/io", os.O_RDONLY)
+        try:
+            content = os.read(fd, 4096)
+        finally:
+            os.close(fd)
+        counters = dict(line.split(b": ") for line in content.splitlines())
+        read_calls, read_bytes = int(counters[b"syscr"]) - own_reads, int(counters[b"rchar"]) - own_bytes
+        own_reads, own_bytes = own_reads + 1, own_bytes + len(content)
+        return read_calls, read_bytes
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+class Rerun:
+    def __init__(self, cprofile=False):
+        self.phases = {}
+        self.stack = []
+        self.start_time = time.perf_counter()
+        self.start_reads = read_counters()
+        self.profiler = None
+        if cprofile:
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextmanager
+    def phase(self, name):
+        # Nested phases are named by their path, e.g. "chapter 2/charts", repeated phases add up
+        self.stack.append(name)
+        path = "/".join(self.stack)
+        start_time, (start_calls, start_bytes) = time.perf_counter(), read_counters()
+        try:
+            yield
+        finally:
+            end_calls, end_bytes = read_counters()
+            phase = self.phases.setdefault(
+                path, {"phase": path, "calls": 0, "seconds": 0.0, "read_calls": 0, "read_bytes": 0}
+            )
+            phase["calls"] += 1
+            phase["seconds"] += time.perf_counter() - start_time
+            phase["read_calls"] += end_calls - start_calls
+            phase["read_bytes"] += end_bytes - start_bytes
+            self.stack.pop()
+
+    def finish(self):
+        end_calls, end_bytes = read_counters()
+        if self.profiler is not None:
+            self.profiler.disable()
+        total = {
+            "phase": "rerun",
+            "calls": 1,
+            "seconds": time.perf_counter() - self.start_time,
+            "read_calls": end_calls - self.start_reads[0],
+            "read_bytes": end_bytes - self.start_reads[1],
+        }
+        return [total] + list(self.phases.values())
+
+
+def start_rerun(force=False):
+    # Start recording this thread's rerun if profiling is enabled (or forced for this session)
+    current.rerun = Rerun(dump_cprofile) if enabled or force else None
+    return current.rerun
+
+
+def phase(name):
+    rerun = getattr(current, "rerun", None)
+    if rerun is None:
+        return noop
+    return rerun.phase(name)
+
+
+def finish_rerun():
+    # Stop recording, export the rerun and return its phases (None when nothing was recorded)
+    global reruns
+    rerun = getattr(current, "rerun", None)
+    if rerun is None:
+        return None
+    current.rerun = None
+    phases = rerun.finish()
+
+    with lock:
+        reruns += 1
+        for record in phases:
+            phase_totals = totals.setdefault(
+                record["phase"], {"calls": 0, "seconds": 0.0, "read_calls": 0, "read_bytes": 0}
+            )
+            for key in phase_totals:
+                phase_totals[key] += record[key]
+        output_dir.mkdir(parents=True, exist_ok=True)
+        line = json.dumps({"time": time.time(), "thread": threading.current_thread().name, "phases": phases})
+        with open(output_dir / "reruns.jsonl", "a") as fp:
+            fp.write(line + "\n")
+        logger.info(line)
+        temp_file = output_dir / "metrics.prom.tmp"
+        temp_file.write_text(metrics_text())
+        os.replace(temp_file, output_dir / "metrics.prom")
+        if rerun.profiler is not None:
+            rerun.profiler.dump_stats(output_dir / f"rerun-{time.strftime('%Y%m%d-%H%M%S')}-{reruns}.prof")
+        if metrics_port and metrics_server is None:
+            serve_metrics(metrics_port)
+    return phases
+
+
+def metrics_text():
+    # Totals of every phase since the process started, in Prometheus text exposition format
+    lines = [
+        "# HELP exports_app_reruns_total Recorded app.py reruns",
+        "# TYPE exports_app_reruns_total counter",
+        f"exports_app_reruns_total {reruns}",
+    ]
+    for key, help_text in [
+        ("calls", "Times each phase ran"),
+        ("seconds", "Time spent in each phase"),
+        ("read_calls", "Read calls made by the process during each phase"),
+        ("read_bytes", "Bytes read by the process during each phase"),
+    ]:
+        name = f"exports_app_phase_{key}_total"
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        lines += [f'{name}{{phase="{phase}"}} {phase_totals[key]}' for phase, phase_totals in totals.items()]
+    return "\n".join(lines) + "\n"
+
+
+def serve_metrics(port):
+    # Serve metrics_text() on every path from a daemon thread, once per process. The http server is only imported
+    # here, it isn't needed on the app's startup path.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                body = metrics_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    global metrics_server
+    metrics_server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    threading.Thread(target=metrics_server.serve_forever, daemon=True).start()
+    return metrics_server
@@ -0,0 +1,144 @@
+import re
+from bisect import bisect_left
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+import charts
+
+# Arabic text normalization, fuzzy name search and the product index behind "which countries buy product X".
+
+diacritics_pattern = re.compile("[\u064b-\u0652\u0670\u0640]")
+punctuation_pattern = re.compile(r"[^\w\s]")
+letter_folds = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ى": "ي", "ة": "ه", "ؤ": "و", "ئ": "ي"})
+
+
+def normalize_arabic(text):
+    # Fold alef/ya/ta-marbuta variants and drop diacritics, tatweel and punctuation
+    text = diacritics_pattern.sub("", str(text)).translate(letter_folds).lower()
+    return " ".join(punctuation_pattern.sub(" ", text).split())
+
+
+def ngrams(text, n=3):
+    # Character n-grams of the text padded with spaces, so word starts and ends count too
+    text = f" {text} "
+    return {text[i : i + n] for i in range(max(len(text) - n + 1, 1))}
+
+
+class FuzzyIndex:
+    # Trigram inverted index for typo tolerant matching plus a sorted word list for prefix (as-you-type) matching
+    def __init__(self, labels, keys=None, weights=None, ngram=3):
+        self.labels = list(labels)
+        self.keys = [normalize_arabic(key) for key in (self.labels if keys is None else keys)]
+        self.weights = np.zeros(len(self.labels)) if weights is None else np.asarray(weights, dtype="float64")
+        self.ngram = ngram
+
+        postings = defaultdict(list)
+        for entry_id, key in enumerate(self.keys):
+            for gram in ngrams(key, ngram):
+                postings[gram].append(entry_id)
+        self.postings = {gram: np.array(entry_ids) for gram, entry_ids in postings.items()}
+
+        # Words are also indexed without the definite article so "سعود" finds "السعوديه"
+        words = []
+        for entry_id, key in enumerate(self.keys):
+            for word in key.split():
+                words.append((word, entry_id))
+                if word.startswith("ال") and len(word) > 3:
+                    words.append((word[2:], entry_id))
+        words.sort()
+        self.words = [word for word, _ in words]
+        self.word_entries = np.array([entry_id for _, entry_id in words], dtype=int)
+        self.exact = defaultdict(list)
+        for entry_id, key in enumerate(self.keys):
+            self.exact[key].append(entry_id)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def word_matches(self, prefix):
+        # Entries having a word that starts with prefix, from one range of the sorted word list
+        start = bisect_left(self.words, prefix)
+        end = bisect_left(self.words, prefix + "\uffff", lo=start)
+        return np.unique(self.word_entries[start:end])
+
+    def prefix_matches(self, query):
+        # Entries having a word starting with every query word
+        matches = sorted((self.word_matches(word) for word in set(query.split())), key=len)
+        entry_ids = matches[0]
+        for word_entry_ids in matches[1:]:
+            entry_ids = np.intersect1d(entry_ids, word_entry_ids, assume_unique=True)
+        return entry_ids
+
+    def similarities(self, query):
+        # Share of the query's n-grams found in every entry, from the postings only, so long names aren't penalized
+        all_grams = ngrams(query, self.ngram)
+        query_grams = [gram for gram in all_grams if gram in self.postings]
+        if len(query_grams) == 0:
+            return np.zeros(len(self.labels))
+        shared = np.bincount(np.concatenate([self.postings[gram] for gram in query_grams]), minlength=len(self.labels))
+        return shared / len(all_grams)
+
+    def search(self, query, limit=10, threshold=0.5):
+        # Exact and prefix matches first (biggest weight first), then fuzzy matches by similarity
+        query = normalize_arabic(query)
+        if query == "":
+            return []
+        exact_ids = self.exact.get(query, [])
+        prefix_ids = np.setdiff1d(self.prefix_matches(query), exact_ids)
+        results = (exact_ids + prefix_ids[np.argsort(-self.weights[prefix_ids], kind="stable")][:limit].tolist())[:limit]
+        if len(results) < limit:
+            similarities = self.similarities(query)
+            similarities[prefix_ids] = 0
+            similarities[exact_ids] = 0
+            candidates = np.flatnonzero(similarities >= threshold)
+            candidates = candidates[np.lexsort((-self.weights[candidates], -similarities[candidates]))]
+            results.extend(candidates[: limit - len(results)].tolist())
+        return [self.labels[entry_id] for entry_id in results]
+
+
+def build_products_table(items_df):
+    # One row per (product, country), grouped by normalized item name and sorted by amount inside each product
+    products_df = items_df.dropna(subset=["Item"]).copy()
+    names = pd.Categorical(products_df["Item"])
+    keys = np.array([normalize_arabic(name) for name in names.categories], dtype=object)
+    products_df["Product"] = keys[names.codes]
+    products_df = products_df[products_df["Product"] != ""]
+    products_df = products_df.groupby(["Product", "Country Code"], as_index=False, sort=False, observed=True).agg(
+        Item=("Item", "first"), Amount=("Amount", "sum")
+    )
+    products_df = products_df.sort_values(["Product", "Amount"], ascending=[True, False], kind="mergesort")
+    return products_df[["Product", "Item", "Country Code", "Amount"]].reset_index(drop=True)
+
+
+class ProductIndex:
+    # Maps a normalized product name to its contiguous block of rows in the products table
+    def __init__(self, products_df):
+        self.products_df = products_df
+        keys = products_df["Product"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) > 0 else np.array([], dtype=int)
+        ends = np.r_[starts[1:], len(keys)]
+        self.slices = {keys[start]: (start, end) for start, end in zip(starts, ends)}
+        # Display name of a product is the item name of its biggest destination
+        self.names = dict(zip(keys[starts], products_df["Item"].to_numpy()[starts]))
+        amounts = charts.widen(products_df["Amount"]).to_numpy(dtype="float64")
+        self.totals = dict(zip(keys[starts], np.add.reduceat(amounts, starts) if len(starts) > 0 else []))
+        self.fuzzy = FuzzyIndex(list(self.slices), weights=list(self.totals.values()))
+
+    def __len__(self):
+        return len(self.slices)
+
+    def __contains__(self, product):
+        return normalize_arabic(product) in self.slices
+
+    def destinations(self, product, n=None):
+        # Countries buying the product, biggest first
+        start, end = self.slices[normalize_arabic(product)]
+        if n is not None:
+            end = min(end, start + n)
+        return self.products_df.iloc[start:end]
+
+    def find(self, query, limit=20):
+        # Products matching the query by prefix (biggest first) or, failing that, by similarity
+        return self.fuzzy.search(query, limit)
@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+# Raw pages as the crawler downloaded them, so the dataset can be re-parsed after a parser fix without crawling again.
+# Bodies are gzipped and stored once under their sha256 (objects/ab/abcd....html.gz), the same hash the crawl
+# manifest keeps, and every crawl day has an index (index/2023-02-25.jsonl) of the URLs it fetched with the hash of
+# the body each one had. Pages that didn't change between crawls share their object.
+
+snapshots_path = Path(__file__).parent / "snapshots"
+
+
+def crawl_date():
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+class SnapshotStore:
+    def __init__(self, root=snapshots_path):
+        self.root = Path(root)
+        self.lock = threading.Lock()
+
+    def object_path(self, sha256):
+        return self.root / "objects" / sha256[:2] / f"{sha256}.html.gz"
+
+    def has(self, sha256):
+        return self.object_path(sha256).exists()
+
+    def put(self, url, content, encoding=None, country_code=None, date=None):
+        # Store the body unless an identical one is already there and index it under url for the crawl date
+        sha256 = hashlib.sha256(content).hexdigest()
+        path = self.object_path(sha256)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+            tmp_path.write_bytes(gzip.compress(content, mtime=0))
+            tmp_path.replace(path)
+        self.record(url, sha256, encoding, country_code, date)
+        return sha256
+
+    def record(self, url, sha256, encoding=None, country_code=None, date=None):
+        # Index an already stored body, e.g. for a page the server answered with 304
+        entry = {"url": url, "sha256": sha256, "encoding": encoding, "country_code": country_code, "time": time.time()}
+        index_file = self.root / "index" / f"{date or crawl_date()}.jsonl"
+        with self.lock:
+            index_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(index_file, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def dates(self):
+        return sorted(path.stem for path in (self.root / "index").glob("*.jsonl"))
+
+    def latest(self, date=None):
+        # Last snapshot of every URL crawled on or before date (all of them by default), by URL
+        entries = {}
+        for index_date in self.dates():
+            if date is not None and index_date > date:
+                break
+            for line in (self.root / "index" / f"{index_date}.jsonl").read_text().splitlines():
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn line of a crawl that died while writing it
+                    continue
+                # Pages recorded on a 304 by older crawls have no encoding, the one of the same body earlier applies
+                previous = entries.get(entry["url"])
+                if entry.get("encoding") is None and previous is not None and previous["sha256"] == entry["sha256"]:
+                    entry["encoding"] = previous.get("encoding")
+                entries[entry["url"]] = {**entry, "date": index_date}
+        return entries
+
+    def get(self, sha256):
+        return gzip.decompress(self.object_path(sha256).read_bytes())
+
+    def summary(self):
+        objects = list((self.root / "objects").glob("*/*.html.gz"))
+        return {
+            "dates": len(self.dates()),
+            "objects": len(objects),
+            "compressed_mb": sum(os.path.getsize(path) for path in objects) / 1e6,
+        }
@@ -0,0 +1,261 @@
+import argparse
+import bisect
+import hashlib
+import html
+import json
+import random
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+import utils
+
+# Local stand-in for EDA's country-info pages so the crawler can be exercised offline.
+# Pages are served from saved HTML files (<ISO3>.html) when available, otherwise they
+# are rendered from the dataset CSVs with the same structure utils.py's XPaths expect.
+# HS chapter pages (hscode != 0) are made up from the country's page: every item is
+# assigned to a chapter by a hash of its name and the totals are scaled by the chapter's
+# share of the items. /stats reports the load the server saw, to check crawler politeness.
+
+base_path = Path(__file__).parent
+dataset_path = base_path / "dataset"
+
+
+def format_money(amount, value):
+    if pd.isna(value):
+        return f"{amount:g}"
+    return f"{amount} {value}"
+
+
+def item_chapter(item):
+    return utils.hs_chapters[int(hashlib.sha1(str(item).encode()).hexdigest()[:8], 16) % len(utils.hs_chapters)]
+
+
+def scale_money(amounts, values, share):
+    # Amounts times share, written in millions or in thousands below a million like the site does (0 stays unitless)
+    millions = utils.normalize_money(pd.DataFrame({"Amount": amounts, "Value": values}), "Amount", "Value")["Amount"]
+    millions = millions.fillna(0).to_numpy() * share
+    scaled = [
+        (round(amount, 1), "مليون دولار") if amount >= 1 else (round(amount * 1000, 1), "ألف دولار")
+        for amount in millions
+    ]
+    return [amount for amount, _ in scaled], [unit if amount > 0 else float("nan") for amount, unit in scaled]
+
+
+def chapter_tables(hscode, items_df, yearly_df, monthly_df, country):
+    # The country's tables restricted to one HS chapter, with the totals scaled by the chapter's share of the items
+    in_chapter = items_df["Item"].map(item_chapter) == hscode
+    amounts = utils.normalize_money(items_df, "Amount", "Value")["Amount"]
+    share = amounts[in_chapter].sum() / amounts.sum() if amounts.sum() > 0 else 0.0
+    yearly_amounts, yearly_values = scale_money(yearly_df["Export Amount"], yearly_df["Export Value"], share)
+    (total_amount,), (total_value,) = scale_money([country["Export Amount"]], [country["Export Value"]], share)
+    return (
+        items_df[in_chapter],
+        yearly_df.assign(**{"Export Amount": yearly_amounts, "Export Value": yearly_values}),
+        monthly_df.assign(
+            **{
+                "Export Amount": [
+                    f"{round(amount):,}" for amount in utils.parse_money_column(monthly_df["Export Amount"]) * share
+                ]
+            }
+        ),
+        total_amount,
+        total_value,
+    )
+
+
+def render_country_page(country_code, dataset_path=dataset_path, hscode="0"):
+    country_path = dataset_path / country_code
+    df_metadata = pd.read_json(dataset_path / "metadata.json", orient="records").set_index("Country Code")
+    country = df_metadata.loc[country_code]
+    items_df = pd.read_csv(country_path / "items.csv", index_col=False)
+    yearly_df = pd.read_csv(country_path / "yearly.csv", index_col=False)
+    monthly_df = pd.read_csv(country_path / "monthly.csv", index_col=False)
+    total_amount, total_value = country["Export Amount"], country["Export Value"]
+    if hscode != "0":
+        items_df, yearly_df, monthly_df, total_amount, total_value = chapter_tables(
+            hscode, items_df, yearly_df, monthly_df, country
+        )
+
+    parts = [
+        "<html><head><meta charset='utf-8'></head><body>",
+        f"<h3><span>الصادرات إلى <span class='text-primary'>{html.escape(country['Country Name'])}</span></span></h3>",
+        f"<div><span class='text-primary'>{format_money(total_amount, total_value)}</span></div>",
+    ]
+
+    # Items table
+    parts.append("<table><thead><tr><th>المنتج</th><th>القيمة</th></tr></thead><tbody>")
+    for idx, row in enumerate(items_df.itertuples(index=False)):
+        item = "" if pd.isna(row.Item) else html.escape(row.Item)
+        parts.append(f"<tr><td>{idx + 1} - {item}</td><td>{format_money(row.Amount, row.Value)}</td></tr>")
+    parts.append("</tbody></table>")
+
+    # Yearly table
+    parts.append("<table><thead><tr><th></th>")
+    parts.extend(f"<th>{year}</th>" for year in yearly_df["Year"])
+    parts.append("</tr></thead><tbody><tr><td>الصادرات</td>")
+    parts.extend(
+        f"<td>{format_money(amount, value)}</td>"
+        for amount, value in zip(yearly_df["Export Amount"], yearly_df["Export Value"])
+    )
+    parts.append("</tr></tbody></table>")
+
+    # Monthly tables, one block per year
+    for year, year_df in monthly_df.groupby("Year", sort=False):
+        parts.append(f"<div class='row geo_info_item'><div><h2>{year}</h2></div><div><table><thead><tr>")
+        parts.extend(f"<th>{month}</th>" for month in year_df["Month"])
+        parts.append("</tr></thead><tbody><tr>")
+        parts.extend(f"<td>{amount}</td>" for amount in year_df["Export Amount"])
+        parts.append("</tr></tbody></table></div></div>")
+
+    parts.append("</body></html>")
+    return "".join(parts).encode("utf-8")
+
+
+def save_pages(output_dir, country_codes=None, dataset_path=dataset_path):
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if country_codes is None:
+        country_codes = sorted(path.name for path in dataset_path.iterdir() if path.is_dir())
+    for country_code in country_codes:
+        (output_dir / f"{country_code}.html").write_bytes(render_country_page(country_code, dataset_path))
+
+
+class ServerStats:
+    # Requests seen by the server: how many were in flight at once and how many arrived within any one second
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.arrivals = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def start(self):
+        with self.lock:
+            self.arrivals.append(time.monotonic())
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def end(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def summary(self):
+        with self.lock:
+            arrivals = sorted(self.arrivals)
+            # Most arrivals in a one second window starting at an arrival
+            window_starts = [arrival + 1.0 for arrival in arrivals]
+            max_per_second = max(
+                (bisect.bisect_left(arrivals, end) - idx for idx, end in enumerate(window_starts)), default=0
+            )
+            return {
+                "requests": len(arrivals),
+                "max_in_flight": self.max_in_flight,
+                "max_per_second": max_per_second,
+                "seconds": arrivals[-1] - arrivals[0] if len(arrivals) > 1 else 0.0,
+            }
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    pages_dir = None
+    dataset_path = dataset_path
+    delay = 0.0
+    error_rate = 0.0
+    stats = ServerStats()
+
+    def do_GET(self):
+        if urlsplit(self.path).path == "/stats":
+            body = json.dumps(self.stats.summary()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.stats.start()
+        try:
+            self.serve_page()
+        finally:
+            self.stats.end()
+
+    def serve_page(self):
+        time.sleep(self.delay)
+        if random.random() < self.error_rate:
+            self.send_error(503)
+            return
+
+        query = parse_qs(urlsplit(self.path).query)
+        country_code = query.get("iso3", [""])[0]
+        hscode = query.get("hscode", ["0"])[0]
+        if hscode != "0" and hscode not in utils.hs_chapters:
+            self.send_error(404)
+            return
+        saved_page = self.pages_dir / f"{country_code}.html" if self.pages_dir is not None else None
+        if hscode == "0" and saved_page is not None and saved_page.exists():
+            body = saved_page.read_bytes()
+            modified_time = saved_page.stat().st_mtime
+        elif (self.dataset_path / country_code).is_dir():
+            body = render_country_page(country_code, self.dataset_path, hscode)
+            modified_time = max(path.stat().st_mtime for path in (self.dataset_path / country_code).iterdir())
+        else:
+            self.send_error(404)
+            return
+
+        # Validators so conditional requests can be answered with 304
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(modified_time, usegmt=True))
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=8000, pages_dir=None, dataset_path=dataset_path, delay=0.0, error_rate=0.0, background=False):
+    handler = type(
+        "Handler",
+        (StandInHandler,),
+        {
+            "pages_dir": Path(pages_dir) if pages_dir is not None else None,
+            "dataset_path": Path(dataset_path),
+            "delay": delay,
+            "error_rate": error_rate,
+            "stats": ServerStats(),
+        },
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+    print(f"Serving country-info pages on http://127.0.0.1:{server.server_port}/map/country-info?hscode=0&iso3=SAU")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve saved country-info pages locally")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--pages", type=Path, default=None, help="Folder of saved <ISO3>.html pages")
+    parser.add_argument("--dataset", type=Path, default=dataset_path, help="Render missing pages from this dataset")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--save", type=Path, default=None, help="Render all pages to this folder and exit")
+    args = parser.parse_args()
+
+    if args.save is not None:
+        save_pages(args.save, dataset_path=args.dataset)
+    else:
+        serve(args.port, args.pages, args.dataset, args.delay, args.error_rate)
@@ -0,0 +1,49 @@
+import html
+
+import numpy as np
+import pandas as pd
+
+# HTML tables for st.markdown. Cells are formatted and escaped a whole column at a time instead of cell by cell
+# like DataFrame.to_html, and long tables are split into pages so a rerun only ships the page on screen.
+
+
+def format_numbers(values, decimals=3, na_rep="-"):
+    # Fixed point text of a numeric column, na_rep where missing
+    values = np.asarray(values, dtype="float64")
+    missing = np.isnan(values)
+    text = np.char.mod(f"%.{decimals}f", np.where(missing, 0, values)).astype(object)
+    text[missing] = na_rep
+    return text
+
+
+def escape_text(values, na_rep="-"):
+    # HTML escaped text of a column, every distinct value is escaped once
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    escaped = np.array([html.escape(str(value)) for value in uniques] + [html.escape(na_rep)], dtype=object)
+    return escaped[codes]
+
+
+def render_table(df, decimals=3, na_rep="-"):
+    # Same markup as DataFrame.to_html(index=False), numeric columns in fixed point with the given decimals and
+    # integer columns (years, counts) without any
+    rows = np.full(len(df), "<tr>", dtype=object)
+    for _, values in df.items():
+        if pd.api.types.is_integer_dtype(values):
+            cells = format_numbers(values, 0, na_rep)
+        elif pd.api.types.is_numeric_dtype(values):
+            cells = format_numbers(values, decimals, na_rep)
+        else:
+            cells = escape_text(values, na_rep)
+        rows = rows + "<td>" + cells + "</td>"
+    header = "".join(f"<th>{html.escape(str(name))}</th>" for name in df.columns)
+    return (
+        '<table border="1" class="dataframe">'
+        f'<thead><tr style="text-align: right;">{header}</tr></thead>'
+        f"<tbody>{''.join(rows + '</tr>')}</tbody></table>"
+    )
+
+
+def pages(df, page_size):
+    # Consecutive slices of at most page_size rows, at least one (maybe empty) page
+    num_pages = max(-(-len(df) // page_size), 1)
+    return [df.iloc[page * page_size : (page + 1) * page_size] for page in range(num_pages)]
@@ -1,97 +1,404 @@
 import re
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from tqdm import tqdm
 import zipfile
 import os
+import json
+import uuid
+import search
+import charts
+from collections import namedtuple
 
 def parse_money(text: str) -> tuple:
     # Get the money value whether it's in float or int
     money = re.findall(r"[-+]?\d*\.\d+|\d+", text)[0]
     return float(money), text.replace(str(money), '').strip()
 
-def extract_items_data(dom, output_file="items.csv"):
-    # Make dataframe for items data
-    df_items = pd.DataFrame(columns=["Item", "Amount", "Value"])
+def make_items_frame(columns):
+    # One typed DataFrame per table instead of growing it row by row
+    return pd.DataFrame(
+        {
+            "Item": pd.Series(columns["Item"], dtype="object"),
+            "Amount": pd.Series(columns["Amount"], dtype="float64"),
+            "Value": pd.Categorical(columns["Value"]),
+        }
+    )
+
+def make_yearly_frame(columns):
+    return pd.DataFrame(
+        {
+            "Year": pd.Series([int(year) for year in columns["Year"]], dtype="int64"),
+            "Export Amount": pd.Series(columns["Export Amount"], dtype="float64"),
+            "Export Value": pd.Categorical(columns["Export Value"]),
+        }
+    )
+
+def make_monthly_frame(columns):
+    # Amounts keep their comma formatted text (e.g. 158,639,855) as stored in monthly.csv
+    return pd.DataFrame(
+        {
+            "Year": pd.Series([int(year) for year in columns["Year"]], dtype="int64"),
+            "Month": pd.Categorical(columns["Month"]),
+            "Export Amount": pd.Series(columns["Export Amount"], dtype="object"),
+        }
+    )
 
-    # Get items data
-    items_table = dom.xpath("//table")[0].xpath(".//tr")
-    for row in items_table:
+def parse_items_table(table):
+    columns = {"Item": [], "Amount": [], "Value": []}
+    for row in table.iter("tr"):
         # Get all cells
-        cells = row.xpath(".//td")
+        cells = list(row.iter("td"))
         if len(cells) > 0:
-            item_name = cells[0].text.split("-")[-1].strip()
-            item_cost = cells[1].text.strip()
-            amount, value = parse_money(item_cost)
-            df_items = df_items.append({"Item": item_name, "Amount": amount, "Value": value}, ignore_index=True)
+            amount, value = parse_money(cells[1].text.strip())
+            columns["Item"].append(cells[0].text.split("-")[-1].strip())
+            columns["Amount"].append(amount)
+            columns["Value"].append(value)
+    return columns
 
-    df_items.to_csv(output_file, index=False)
+def parse_yearly_table(table):
+    years = table.xpath(".//thead/tr/th/text()")
+    values = [parse_money(value) for value in table.xpath(".//tbody/tr[1]/td/text()")[1:]]
+    if len(years) != len(values):
+        raise ValueError(f"Found {len(years)} years but {len(values)} yearly values")
+    return {
+        "Year": years,
+        "Export Amount": [amount for amount, _ in values],
+        "Export Value": [value for _, value in values],
+    }
+
+def parse_monthly_block(block, columns):
+    year = "".join(block.xpath(".//div/h2/text()")).strip()
+    months = block.xpath(".//table/thead/tr/th/text()")
+    monthly_exports = block.xpath(".//table/tbody/tr/td/text()")
+    if len(monthly_exports) < len(months):
+        raise ValueError(f"Found {len(months)} months but {len(monthly_exports)} monthly values in {year}")
+    columns["Year"].extend([year] * len(months))
+    columns["Month"].extend(months)
+    columns["Export Amount"].extend(monthly_exports[: len(months)])
+    return columns
+
+def extract_items_data(dom, output_file="items.csv"):
+    items_table = dom.xpath("//table")[0]
+    make_items_frame(parse_items_table(items_table)).to_csv(output_file, index=False)
 
 def extract_yearly_data(dom, output_file="yearly.csv"):
-    # Make dataframe for yearly data
-    df_yearly = pd.DataFrame(columns=["Year", "Export Amount", "Export Value"])
     main_table = dom.xpath("//table")[1]
-
-    # Get yearly exports data
-    years = main_table.xpath(".//thead/tr/th/text()")
-    yearly_exports_amount = [parse_money(value)[0] for value in main_table.xpath(".//tbody/tr[1]/td/text()")[1:]]
-    yearly_exports_value = [parse_money(value)[1] for value in main_table.xpath(".//tbody/tr[1]/td/text()")[1:]]
-    df_yearly["Year"] = years
-    df_yearly["Export Amount"] = yearly_exports_amount
-    df_yearly["Export Value"] = yearly_exports_value
-    
-    df_yearly.to_csv(output_file, index=False)
+    make_yearly_frame(parse_yearly_table(main_table)).to_csv(output_file, index=False)
 
 def extract_monthly_yearly_data(dom, output_file="monthly.csv"):
-    # Make dataframe for yearly-monthly data
-    df_monthly = pd.DataFrame(columns=["Year", "Month", "Export Amount"])
-
-    # Get monthly exports data
-    yearly_monthly_exports = dom.xpath("//div[@class='row geo_info_item']")
-    # print(len(yearly_monthly_exports))
-    for yearly_monthly_export in yearly_monthly_exports:
-        # Get year
-        year = "".join(yearly_monthly_export.xpath(".//div/h2/text()")).strip()
-        # Get monthly exports
-        months = yearly_monthly_export.xpath(".//table/thead/tr/th/text()")
-        # print(year, months)
-        monthly_exports = [x for x in yearly_monthly_export.xpath(".//table/tbody/tr/td/text()")]
-        # print(monthly_exports)
-        for i in range(len(months)):
-            df_monthly = df_monthly.append({"Year": year, "Month": months[i], "Export Amount": monthly_exports[i]}, ignore_index=True)
-
-    df_monthly.to_csv(output_file, index=False)
-
-def clean_dataset(dataset_path):
-    dataset_path = Path(dataset_path)
-    for country_path in tqdm(dataset_path.iterdir()):
-        all_files = list(country_path.iterdir())
-        if len(all_files) < 4:
-            for file in country_path.iterdir():
-                file.unlink()
-            country_path.rmdir()
+    columns = {"Year": [], "Month": [], "Export Amount": []}
+    for yearly_monthly_export in dom.xpath("//div[@class='row geo_info_item']"):
+        parse_monthly_block(yearly_monthly_export, columns)
+    make_monthly_frame(columns).to_csv(output_file, index=False)
+
+def parse_country_page(content, encoding="utf-8", chunk_size=16384):
+    # Single pass over the raw page bytes, each table is read when its end tag arrives and freed right after
+    from lxml import etree
+
+    parser = etree.HTMLPullParser(events=("end",), encoding=encoding)
+    page = {
+        "country_name": None,
+        "total_export_text": None,
+        "items": {"Item": [], "Amount": [], "Value": []},
+        "yearly": {"Year": [], "Export Amount": [], "Export Value": []},
+        "monthly": {"Year": [], "Month": [], "Export Amount": []},
+    }
+    tables_seen = 0
+
+    for start in range(0, len(content), chunk_size):
+        parser.feed(content[start : start + chunk_size])
+        for _, element in parser.read_events():
+            tag = element.tag
+            if tag == "span" and element.get("class") == "text-primary":
+                parent = element.getparent()
+                if page["country_name"] is None and parent.tag == "span" and parent.getparent().tag == "h3":
+                    page["country_name"] = element.text
+                elif page["total_export_text"] is None and parent.tag == "div":
+                    page["total_export_text"] = element.text
+            elif tag == "table" and not any(div.get("class") == "row geo_info_item" for div in element.iterancestors("div")):
+                if tables_seen == 0:
+                    page["items"] = parse_items_table(element)
+                elif tables_seen == 1:
+                    page["yearly"] = parse_yearly_table(element)
+                tables_seen += 1
+                element.clear()
+            elif tag == "div" and element.get("class") == "row geo_info_item":
+                parse_monthly_block(element, page["monthly"])
+                element.clear()
+    parser.close()
+
+    if page["country_name"] is None or page["total_export_text"] is None:
+        raise ValueError("Country name or total exports not found in page")
+    return page
+
+def write_country_page(page, country_path):
+    country_path = Path(country_path)
+    make_items_frame(page["items"]).to_csv(country_path / "items.csv", index=False)
+    make_yearly_frame(page["yearly"]).to_csv(country_path / "yearly.csv", index=False)
+    make_monthly_frame(page["monthly"]).to_csv(country_path / "monthly.csv", index=False)
+
+arabic_months = {
+    "يناير": 1,
+    "فبراير": 2,
+    "مارس": 3,
+    "إبريل": 4,
+    "أبريل": 4,
+    "ابريل": 4,
+    "مايو": 5,
+    "يونيو": 6,
+    "يوليو": 7,
+    "أغسطس": 8,
+    "اغسطس": 8,
+    "سبتمبر": 9,
+    "أكتوبر": 10,
+    "اكتوبر": 10,
+    "نوفمبر": 11,
+    "ديسمبر": 12,
+}
+
+def add_month_periods(monthly_df):
+    # Month number from the Arabic month name, a sortable date and the "2012 - يناير" chart label
+    month_numbers = monthly_df["Month"].map(arabic_months)
+    if month_numbers.isna().any():
+        raise ValueError(f"Unknown month names: {set(monthly_df.loc[month_numbers.isna(), 'Month'])}")
+    return monthly_df.assign(
+        **{
+            "Month Number": month_numbers.astype("int64"),
+            "Date": pd.to_datetime(pd.DataFrame({"year": monthly_df["Year"], "month": month_numbers, "day": 1})),
+            "Period": monthly_df["Year"].astype(str) + " - " + monthly_df["Month"],
+        }
+    )
+
+# Two-digit HS chapters the site can break exports down by (77 is reserved), hscode=0 is all products
+hs_chapters = [f"{chapter:02d}" for chapter in range(1, 98) if chapter != 77]
+
+money_units = {"مليون": 1000000, "ألف": 1000, "مليار": 1000000000}
+
+def money_multipliers(values):
+    # Multiplier of each unit text (e.g. "مليون دولار"), looked up once per distinct unit, NaN where unknown
+    values = pd.Categorical(values)
+    multipliers = [next((money_units[key] for key in money_units if key in unit), np.nan) for unit in values.categories]
+    # Missing units have code -1, which picks the trailing NaN
+    return np.append(np.asarray(multipliers, dtype="float64"), np.nan)[values.codes]
 
 def normalize_money(df, money_column_name, value_column_name, normalize_to="مليون"):
-    values_dict = {"مليون": 1000000, "ألف": 1000, "مليار": 1000000000}
-    df[value_column_name].fillna("لا شئ", inplace=True)
-    for key, value in values_dict.items():
-        if value != "لا شئ":
-            df.loc[df[value_column_name].str.contains(key), money_column_name] = df[money_column_name] * value / values_dict[normalize_to]
-    
-    return df
+    # Returns a new frame with the money column as float in normalize_to units, amounts without a known unit are kept
+    amounts = pd.to_numeric(df[money_column_name], errors="coerce").to_numpy(dtype="float64")
+    multipliers = money_multipliers(df[value_column_name])
+    normalized = np.where(np.isnan(multipliers), amounts, amounts * multipliers / money_units[normalize_to])
+    return df.assign(**{money_column_name: normalized})
+
+def parse_money_column(values):
+    # Vectorized str_money2int for a column of comma formatted amounts (e.g. 158,639,855)
+    if pd.api.types.is_numeric_dtype(values) or len(values) == 0:
+        return values.astype("float64")
+    # Strip the thousands separators of the whole column in one string operation
+    text = "\n".join(values.astype(str)).replace(",", "")
+    return pd.Series(np.array(text.split("\n"), dtype="float64"), index=values.index, name=values.name)
+
+def dataset_entries(dataset_path):
+    # Country folders and metadata.json of a dataset, without the crawler's state (manifest, journal, .staging/)
+    # which changes during every crawl without changing the data
+    return [
+        entry for entry in os.scandir(dataset_path)
+        if not entry.name.startswith(".") and (entry.is_dir() or entry.name == "metadata.json")
+    ]
+def dataset_signature(dataset_path):
+    # Changes whenever a dataset file is added, removed or modified, cheap enough to check on every rerun
+    files, mtime = 0, 0
+    for entry in dataset_entries(dataset_path):
+        for file in os.scandir(entry.path) if entry.is_dir() else [entry]:
+            files += 1
+            mtime = max(mtime, file.stat().st_mtime_ns)
+    return {"files": files, "mtime": mtime}
+
+# Bump store_format whenever the tables written by build_store change
+store_format = 5
+store_tables = ("countries", "items", "yearly", "monthly", "products")
+# Columns the store keeps in float64: monthly amounts are whole dollars in millions (158.639855), which float32 would
+# round to about 7 significant digits (158.63986)
+exact_columns = {"monthly": ["Export Amount"]}
+
+def store_version(dataset_path):
+    return {"format": store_format, **dataset_signature(dataset_path)}
+
+def read_country_csvs(country_path):
+    # Items, yearly and monthly frames of one country folder as crawled, yearly amounts kept as written
+    return (
+        pd.read_csv(country_path / "items.csv", index_col=False),
+        pd.read_csv(country_path / "yearly.csv", index_col=False, dtype={"Export Amount": str}),
+        pd.read_csv(country_path / "monthly.csv", index_col=False),
+    )
+
+def normalize_tables(items_df, yearly_df, monthly_df):
+    # Store rows of frames already tagged with their Country Code, amounts in million dollars
+    items_df = normalize_money(items_df, "Amount", "Value")
+    yearly_df = normalize_money(yearly_df, "Export Amount", "Export Value")
+    monthly_df = monthly_df.assign(**{"Export Amount": parse_money_column(monthly_df["Export Amount"]) / 1e6})
+    return items_df, yearly_df, monthly_df
+
+def in_country_order(df, country_codes):
+    # Rows of the given countries only, grouped in their order and otherwise in the order they came
+    codes = pd.Categorical(df["Country Code"], categories=country_codes).codes
+    order = np.argsort(codes, kind="stable")
+    return df.iloc[order[codes[order] >= 0]]
+
+def build_store(dataset_path, store_path, normalized_tables=None, excluded=()):
+    # Compile the per-country CSVs into one Arrow file per table, amounts in million dollars. normalized_tables can
+    # hold the normalize_tables frames of the countries when they were already read (e.g. by pipeline.py), excluded
+    # countries are listed in metadata.json but left out of the store (they failed validation)
+    dataset_path, store_path = Path(dataset_path), Path(store_path)
+    store_path.mkdir(parents=True, exist_ok=True)
+    # Taken before reading, a dataset changed during the build is then picked up by the next load
+    version = store_version(dataset_path)
+
+    df_countries = pd.read_json(dataset_path / "metadata.json", orient="records")
+    df_countries = normalize_money(df_countries, "Export Amount", "Export Value")
+    df_countries = df_countries[~df_countries["Country Code"].isin(excluded)].reset_index(drop=True)
+    country_codes = df_countries["Country Code"].tolist()
+    if normalized_tables is None:
+        country_frames = [read_country_csvs(dataset_path / country_code) for country_code in country_codes]
+        normalized_tables = normalize_tables(
+            *(
+                pd.concat(
+                    [frames[idx].assign(**{"Country Code": code}) for code, frames in zip(country_codes, country_frames)],
+                    ignore_index=True,
+                )
+                for idx in range(3)
+            )
+        )
+    items, yearly, monthly = (in_country_order(df, country_codes) for df in normalized_tables)
+    # Every country's items biggest first (ties in the order they came), as the site lists them and the app's top N
+    # tables and the history expect whatever order the CSV has
+    positions = pd.Categorical(items["Country Code"], categories=country_codes).codes
+    items = items.assign(Position=positions).sort_values(["Position", "Amount"], ascending=[True, False], kind="mergesort").drop(columns="Position")
+
+    tables = {
+        "countries": df_countries[["Country Code", "Country Name", "Export Amount", "Color"]],
+        "items": items[["Country Code", "Item", "Amount"]].reset_index(drop=True),
+        "yearly": yearly[["Country Code", "Year", "Export Amount"]].reset_index(drop=True),
+        "monthly": add_month_periods(monthly.reset_index(drop=True))[
+            ["Country Code", "Year", "Month", "Month Number", "Date", "Period", "Export Amount"]
+        ],
+    }
+    tables["products"] = search.build_products_table(tables["items"])
+    # Compact types (float32 amounts, int16 years, dictionary encoded strings) so every process holds little of them
+    tables = {name: charts.downcast(df, exact_columns.get(name, ())) for name, df in tables.items()}
+    # Sessions of the app and the API can rebuild a stale store at the same time, every build writes its own
+    # temporary files and renames them over the previous ones
+    build_id = uuid.uuid4().hex[:8]
+    for name, df in tables.items():
+        # Uncompressed so the files can be memory mapped as they are
+        tmp_file = store_path / f"{name}.arrow.{build_id}.tmp"
+        df.to_feather(tmp_file, compression="uncompressed")
+        os.replace(tmp_file, store_path / f"{name}.arrow")
+    tmp_file = store_path / f"version.json.{build_id}.tmp"
+    tmp_file.write_text(json.dumps(version))
+    os.replace(tmp_file, store_path / "version.json")
+    return tables
+
+def load_store(dataset_path, store_path, tables=store_tables):
+    # Read the consolidated tables (or only the given ones), rebuilding them first if the dataset changed since the last build
+    dataset_path, store_path = Path(dataset_path), Path(store_path)
+    version_file = store_path / "version.json"
+    if not version_file.exists() or json.loads(version_file.read_text()) != store_version(dataset_path):
+        # Countries the last pipeline build found errors in stay out until a build validates them again
+        report_file = store_path / "build_report.json"
+        excluded = json.loads(report_file.read_text())["excluded"] if report_file.exists() else ()
+        build_store(dataset_path, store_path, excluded=excluded)
+
+    from pyarrow import feather
+
+    # Split blocks keep the numeric columns and category codes as read-only views of the memory mapped files
+    # instead of copies, the pages are shared by every process reading the store
+    return {
+        name: feather.read_table(store_path / f"{name}.arrow", memory_map=True).to_pandas(split_blocks=True)
+        for name in tables
+    }
+
+def memory_footprint(tables):
+    # Megabytes the loaded tables hold (strings counted once per category) against the same tables with object
+    # strings, float64 and int64 columns, as they were loaded before the store was compacted
+    rows = []
+    for name, df in tables.items():
+        expanded_types = {}
+        for column, values in df.items():
+            if values.dtype == "category":
+                expanded_types[column] = object
+            elif values.dtype.kind in "if":
+                expanded_types[column] = values.dtype.kind + "8"
+        compact_mb = df.memory_usage(deep=True).sum() / 1e6
+        expanded_mb = df.astype(expanded_types).memory_usage(deep=True).sum() / 1e6
+        rows.append({"Table": name, "Rows": len(df), "MB": compact_mb, "Expanded MB": expanded_mb})
+    return pd.DataFrame(rows).set_index("Table")
+
+Country = namedtuple("Country", ["code", "name", "color", "export_amount"])
+
+class CountryRegistry:
+    # Name <-> code lookups built once from the countries table instead of scanning it per lookup
+    def __init__(self, df_countries):
+        self.countries = {
+            code: Country(code, name, color, export_amount)
+            for code, name, color, export_amount in zip(
+                df_countries["Country Code"], df_countries["Country Name"], df_countries["Color"], df_countries["Export Amount"]
+            )
+        }
+        self.codes = {country.name: code for code, country in self.countries.items()}
+        self.names = list(self.codes)
+        # Countries can be found by any spelling of their name or by their code
+        self.fuzzy = search.FuzzyIndex(
+            self.names,
+            keys=[f"{country.name} {code}" for code, country in self.countries.items()],
+            weights=[country.export_amount for country in self.countries.values()],
+        )
+
+    def __len__(self):
+        return len(self.countries)
+
+    def by_code(self, country_code):
+        return self.countries[country_code]
+
+    def by_name(self, country_name):
+        return self.countries[self.codes[country_name]]
+
+    def find(self, query, limit=10):
+        return self.fuzzy.search(query, limit)
+
+def country_table(df, country_code):
+    # Rows of one country from a consolidated table, indexed like its own CSV
+    return df[df["Country Code"] == country_code].drop(columns=["Country Code"]).reset_index(drop=True)
 
 def zip_directory(input_dir, output_file):
     # Create a ZipFile object
     zipf = zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED)
     
-    # Walk through the directory tree and add each file to the zip file
-    for root, dirs, files in os.walk(input_dir):
-        for file in files:
-            zipf.write(os.path.join(root, file))
+    # Add each file of the country folders and metadata.json to the zip file (e.g. dataset/SAU/items.csv)
+    for entry in dataset_entries(input_dir):
+        file_paths = [os.path.join(entry.path, file) for file in sorted(os.listdir(entry.path))] if entry.is_dir() else [entry.path]
+        for file_path in file_paths:
+            zipf.write(file_path, os.path.relpath(file_path, os.path.dirname(os.path.abspath(input_dir))))
     
     # Close the ZipFile
     zipf.close()
 
+def cached_zip_directory(input_dir, output_file, version):
+    # Reuse the archive as long as it was built from the same dataset version
+    output_file = Path(output_file)
+    version_file = output_file.with_suffix(".json")
+    if output_file.exists() and version_file.exists() and json.loads(version_file.read_text()) == version:
+        return output_file
+
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    # Sessions are threads of one process and can build the archive at the same time, each writes its own file
+    tmp_file = output_file.with_suffix(f".{uuid.uuid4().hex[:8]}.tmp")
+    zip_directory(input_dir, tmp_file)
+    tmp_file.replace(output_file)
+    tmp_file = version_file.with_suffix(f".{uuid.uuid4().hex[:8]}.tmp")
+    tmp_file.write_text(json.dumps(version))
+    tmp_file.replace(version_file)
+    return output_file
+
 def str_money2int(text: str) -> int:
     # Extract number from string (e.g. 543,354)
     money = text.replace(",", "")
@@ -101,5 +408,4 @@ def str_money2int(text: str) -> int:
 if __name__ == "__main__":
     # print(parse_money(
     # "0 ألف دولار"))
-    # clean_dataset("dataset")
     print(str_money2int("0"))
\ No newline at end of file